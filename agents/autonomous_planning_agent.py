@@ -1,6 +1,11 @@
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
 import json
-from openai import OpenAI
+import os
+import time
+import contextvars
+from opentelemetry import trace
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionToolMessageParam
 
 ### Internal Classes
@@ -9,6 +14,10 @@ from agents.deals import Deal, Opportunity
 from agents.scanner_agent import ScannerAgent
 from agents.ensemble_agent import EnsembleAgent
 from agents.messaging_agent import MessagingAgent
+from agents.seen_deals import SeenDealIndex
+import openai_pool
+
+tracer = trace.get_tracer(__name__)
 
 ### LLM-driven, tool-calling orchestrator (agentic)
 
@@ -16,18 +25,36 @@ class AutonomousPlanningAgent(Agent):
     name = "Autonomous Planning Agent"
     color = Agent.GREEN
     MODEL = "gpt-5-mini"
+    ### Tool calls of one assistant turn are run concurrently, e.g. one estimate per deal
+    TOOL_WORKERS = int(os.getenv("PLANNER_TOOL_WORKERS", "5"))
+
+    ### Budgets of a single run; the run stops, keeping whatever it surfaced, when any is used up
+    MAX_TURNS = int(os.getenv("PLANNER_MAX_TURNS", "10"))
+    MAX_TOKENS = int(os.getenv("PLANNER_MAX_TOKENS", "100000"))
+    DEADLINE_SECONDS = float(os.getenv("PLANNER_DEADLINE_SECONDS", "300"))
+
+    ### Length of the description kept for each deal once the scan has been compacted
+    SUMMARY_CHARS = 80
 
-    def __init__(self, collection):
+    def __init__(self, collection, seen: SeenDealIndex = None):
         """
         Create instances of the 3 Agents that this planner coordinates across
+        :param collection: Chroma DB collection provided for the frontier model with RAG
+        :param seen: (Optional) index of deals already scanned, so they're not priced again
         """
         self.log(f"{self.name} is initializing...")
-        self.scanner_agent = ScannerAgent()
+        self.seen = seen
+        self.scanner_agent = ScannerAgent(seen=seen)
         self.ensemble_agent = EnsembleAgent(collection)
         self.messanger_agent = MessagingAgent()
-        self.openai = OpenAI()
+        self.openai = openai_pool.client_for(self.name)
+        self.executor = ThreadPoolExecutor(max_workers=self.TOOL_WORKERS, thread_name_prefix="planner-tool")
         self.memory = None
         self.opportunity = None
+        ### The deals of the current run's scan, by id
+        self.deals: Dict[int, Deal] = {}
+        ### Token usage of the last run
+        self.usage = Counter()
         self.log(f"{self.name} is ready")
 
 
@@ -37,7 +64,43 @@ class AutonomousPlanningAgent(Agent):
         """
         self.log(f"{self.name} is calling Scanner Agent to scan deals online")
         scanned_deals = self.scanner_agent.scan(memory=self.memory)
-        return scanned_deals.model_dump_json() if scanned_deals else "No deals found"
+        if not scanned_deals:
+            return "No deals found"
+        if self.seen is not None:
+            self.seen.update(deal.url for deal in scanned_deals.deals)
+        self.deals = dict(enumerate(scanned_deals.deals, 1))
+        return json.dumps([{"id": i, **deal.model_dump()} for i, deal in self.deals.items()])
+
+    def compact_scan(self) -> str:
+        """
+        The scanned deals without their full descriptions, to replace the scan in the conversation
+        once the LLM has read it
+        """
+        deals = [
+            {"id": i, "summary": deal.product_description[:self.SUMMARY_CHARS], "price": deal.price, "url": deal.url}
+            for i, deal in self.deals.items()
+        ]
+        return json.dumps({"deals": deals, "note": "Descriptions shortened; they were given in full earlier. Estimate deals by id"})
+
+    def resolve(self, description: str) -> Tuple[Optional[int], str]:
+        """
+        The scanned deal an estimate tool was given, and its full description. Once the scan is compacted,
+        the LLM only has each deal's id and summary, so either of those is resolved as well as the full text
+        :return: (deal id, full description), or (None, the description as given) for an unknown product
+        """
+        text = description.strip()
+        if text.isdigit() and int(text) in self.deals:
+            return int(text), self.deals[int(text)].product_description
+        for i, deal in self.deals.items():
+            if deal.product_description == description:
+                return i, description
+        ### A summary is the start of the description, perhaps with an ellipsis added
+        summary = text.rstrip(".…").rstrip()
+        if len(summary) >= self.SUMMARY_CHARS // 2:
+            for i, deal in self.deals.items():
+                if deal.product_description.startswith(summary):
+                    return i, deal.product_description
+        return None, description
 
 
     def estimate_true_value(self, description: str) -> str:
@@ -45,8 +108,22 @@ class AutonomousPlanningAgent(Agent):
         Run the tool via LLM to estimate the actual price value of a product
         """
         self.log(f"{self.name} is calling Ensemble Agent to estimate the true value")
+        deal_id, description = self.resolve(description)
         estimate = self.ensemble_agent.price(description=description)
-        return f"The estimated true value of {description} is {estimate}"
+        ### The tool call id already ties the result to the description, so it isn't repeated
+        return f"The estimated true value of deal {deal_id} is {estimate}" if deal_id else f"The estimated true value is {estimate}"
+
+    def estimate_true_values(self, descriptions: List[str]) -> str:
+        """
+        Run the tool via LLM to estimate the actual price values of several products in one go
+        """
+        self.log(f"{self.name} is calling Ensemble Agent to estimate {len(descriptions)} true values")
+        resolved = [self.resolve(description) for description in descriptions]
+        estimates = self.ensemble_agent.price_all([description for _, description in resolved], workers=self.TOOL_WORKERS)
+        return json.dumps([
+            {"id": deal_id, "estimated_true_value": estimate}
+            for (deal_id, _), estimate in zip(resolved, estimates)
+        ])
 
     def notify_user_of_deal(
             self, description: str, deal_price: float, estimated_true_value: float, url: str
@@ -55,6 +132,10 @@ class AutonomousPlanningAgent(Agent):
         Run the tool via LLM to notify the user of the best deal
         """
         self.log(f"{self.name} is calling Messanger Agent to notify the best deal")
+        ### The LLM may only have the shortened description by now; use the full one
+        for deal in self.deals.values():
+            if deal.url == url:
+                description = deal.product_description
         self.messanger_agent.notify(
             description,
             deal_price,
@@ -93,7 +174,7 @@ class AutonomousPlanningAgent(Agent):
             "properties": {
                 "description": {
                     "type": "string",
-                    "description": "The description of the item to be estimated for the actual price"
+                    "description": "The description of the item to be estimated for the actual price, or the id of a scanned deal"
                 },
             },
             "required": ["description"],
@@ -101,6 +182,23 @@ class AutonomousPlanningAgent(Agent):
         },
     }
 
+    estimate_all_function = {
+        "name": "estimate_true_values",
+        "description": "Given the descriptions of several items, estimate how much each is actually worth, all at once. Prefer this to estimating items one by one",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "descriptions": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "The descriptions of the items to be estimated for the actual price, or the ids of scanned deals"
+                },
+            },
+            "required": ["descriptions"],
+            "additionalProperties": False,
+        },
+    }
+
     notify_function = {
         "name": "notify_user_of_deal",
         "description": "Send the user a push notification about the single most compelling deal; only call this one time",
@@ -137,41 +235,50 @@ class AutonomousPlanningAgent(Agent):
         return [
             {"type": "function", "function": self.scan_function},
             {"type": "function", "function": self.estimate_function},
+            {"type": "function", "function": self.estimate_all_function},
             {"type": "function", "function": self.notify_function}
         ]
 
 
+    def call_tool(self, tool, tool_call) -> ChatCompletionToolMessageParam:
+        # Convert the JSON string into dict
+        arguments: dict = json.loads(tool_call.function.arguments)
+        with tracer.start_as_current_span("planner.tool", attributes={"tool": tool_call.function.name}):
+            return {"role": "tool", "content": tool(**arguments), "tool_call_id": tool_call.id}
+
+
     def handle_tool_call(self, message) -> List[ChatCompletionToolMessageParam]:
         """
-        Actually call the tools associated with this message
+        Actually call the tools associated with this message, concurrently
+        :return: the tool messages, in the order of the tool calls
         """
-        results = []
-
         mapping = {
             "scan_the_internet_for_bargains": self.scan_the_internet_for_bargains,
             "estimate_true_value": self.estimate_true_value,
+            "estimate_true_values": self.estimate_true_values,
             "notify_user_of_deal": self.notify_user_of_deal
         }
 
+        tools = []
         for tool_call in message.tool_calls:
             tool_name = tool_call.function.name
-            # Convert the JSON string into dict
-            arguments: dict = json.loads(tool_call.function.arguments)
             tool = mapping.get(tool_name)
-
             if not tool:
                 raise ValueError(f"Unknown tool called: {tool_name}")
-
-            result = tool(**arguments) if tool else None
-            results.append(
-                {"role": "tool", "content": result, "tool_call_id": tool_call.id}
-            )
-
-        return results
+            tools.append(tool)
+
+        if len(tools) == 1:
+            return [self.call_tool(tools[0], message.tool_calls[0])]
+        ### Each tool runs in a copy of this context, so its spans stay in the run's trace
+        futures = [
+            self.executor.submit(contextvars.copy_context().run, self.call_tool, tool, tool_call)
+            for tool, tool_call in zip(tools, message.tool_calls)
+        ]
+        return [future.result() for future in futures]
 
     system_message = "You find great deals on bargain products using your tools, and notify the user of the best bargain."
     user_message = """
-    First, use your tool to scan the internet for bargain deals. Then for each deal, use your tool to estimate its true value.
+    First, use your tool to scan the internet for bargain deals. Then use your tool to estimate the true values of all the deals at once.
     Then pick the single most compelling deal where the price is much lower than the estimated true value, and use your tool to notify the user.
     Then just reply OK to indicate success.
     """
@@ -192,38 +299,56 @@ class AutonomousPlanningAgent(Agent):
         self.log(f"{self.name} is kicking off a run")
         self.memory = memory
         self.opportunity = None
+        self.deals = {}
+        self.usage = Counter()
         messages = self.messages[:]
+        deadline = time.monotonic() + self.DEADLINE_SECONDS
+        ### Scan results to shorten once the LLM has read them in full
+        to_compact: List[int] = []
+        reply = None
+
+        for turn in range(1, self.MAX_TURNS + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.usage["total_tokens"] >= self.MAX_TOKENS:
+                self.log(f"{self.name} stopped: out of {'time' if remaining <= 0 else 'tokens'} after {turn - 1} turns")
+                break
 
-        while True:
             response = self.openai.chat.completions.create(
                 model=self.MODEL,
                 messages=messages,
-                tools=self.get_tools()
+                tools=self.get_tools(),
+                timeout=remaining,
             )
+            if response.usage:
+                self.usage.update(
+                    prompt_tokens=response.usage.prompt_tokens,
+                    completion_tokens=response.usage.completion_tokens,
+                    total_tokens=response.usage.total_tokens,
+                )
+            self.usage["turns"] = turn
+
+            for index in to_compact:
+                messages[index] = {**messages[index], "content": self.compact_scan()}
+            to_compact = []
 
             if response.choices[0].finish_reason == "tool_calls":
                 tool_call_msg = response.choices[0].message
                 tool_call_result = self.handle_tool_call(tool_call_msg)
                 messages.append(tool_call_msg) # Assistant message
-                messages.extend(tool_call_result) # Tool call messages
+                for tool_call, result in zip(tool_call_msg.tool_calls, tool_call_result):
+                    if tool_call.function.name == "scan_the_internet_for_bargains" and self.deals:
+                        to_compact.append(len(messages))
+                    messages.append(result) # Tool call message
                 continue
-            else:
-                break
 
-        reply = response.choices[0].message.content
+            reply = response.choices[0].message.content
+            break
+        else:
+            self.log(f"{self.name} stopped: reached the limit of {self.MAX_TURNS} turns")
+
+        self.log(
+            f"{self.name} used {self.usage['turns']} turns, {self.usage['prompt_tokens']:,} prompt and "
+            f"{self.usage['completion_tokens']:,} completion tokens"
+        )
         self.log(f"Autonomous Planning Agent completed with: {reply}")
         return self.opportunity
-
-
-
-
-
-
-
-
-
-
-
-
-
-
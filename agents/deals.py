@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Dict, Self, Any
+from typing import List, Dict, Self, Any, Callable
 from bs4 import BeautifulSoup
 import re
 import feedparser
@@ -7,6 +7,8 @@ from tqdm import tqdm
 import requests
 import time
 import ssl
+from opentelemetry import trace
+from agents.seen_deals import deal_key
 
 ### Add ssl to prevent the ssl issue for feedparser accessing.
 if hasattr(ssl, '_create_unverified_context'):
@@ -21,6 +23,8 @@ feeds = [
 # You could also add: "https://www.dealnews.com/c238/Automotive/?rss=1"
 # "https://www.dealnews.com/c196/Home-Garden/?rss=1"
 
+tracer = trace.get_tracer(__name__)
+
 def extract(html_snippet: str) -> str:
     """
     A utility function that uses Beautiful Soup to clean up this HTML snippet and extract useful text
@@ -55,7 +59,10 @@ class ScrapedDeal:
         self.title = entry["title"]
         self.summary = extract(entry["summary"])
         self.url = entry["links"][0]["href"]
-        raw_page_content = requests.get(self.url).content ### Get text at the page level (for product details)
+        with tracer.start_as_current_span("scrape.fetch", attributes={"deal.url": self.url}) as span:
+            response = requests.get(self.url) ### Get text at the page level (for product details)
+            span.set_attribute("http.status_code", response.status_code)
+            raw_page_content = response.content
         soup = BeautifulSoup(raw_page_content, "html.parser")
         content = soup.find("div", class_="content-section").get_text()
         content = content.replace("\nmore", "").replace("\n", " ")
@@ -89,20 +96,31 @@ class ScrapedDeal:
         return f"Title: {self.title}\n\nDetails: {self.details.strip()}\n\nFeatures: {self.features.strip()}\n\nURL: {self.url}"
 
     @classmethod
-    def fetch(cls, show_progress: bool = False) -> List["ScrapedDeal"]: #forward reference
+    def fetch(cls, show_progress: bool = False, skip: Callable[[str], bool] = None) -> List["ScrapedDeal"]: #forward reference
         """
-        Retrieve all deals from the selected RSS feeds
+        Retrieve all deals from the selected RSS feeds.
+        A deal listed in several feeds is only fetched once, and deals for which skip(url) is true aren't fetched at all
+
+        :param show_progress: show a progress bar over the feeds
+        :param skip: (Optional) predicate on an entry's URL, for deals that have already been seen
         """
         deals = []
+        keys = set()
         feed_iter = tqdm(feeds) if show_progress else feeds
         for feed_url in feed_iter:
-            feed = feedparser.parse(
-                feed_url,
-                request_headers={
-                    "User-Agent": "Mozilla/5.0 (compatible; DealFetcher/1.0)",
-                }
-            )
+            with tracer.start_as_current_span("scrape.feed", attributes={"feed.url": feed_url}):
+                feed = feedparser.parse(
+                    feed_url,
+                    request_headers={
+                        "User-Agent": "Mozilla/5.0 (compatible; DealFetcher/1.0)",
+                    }
+                )
             for entry in feed["entries"][:10]:
+                url = entry["links"][0]["href"]
+                key = deal_key(url)
+                if key in keys or (skip and skip(url)):
+                    continue
+                keys.add(key)
                 deals.append(cls(entry))
                 time.sleep(0.5)
 
@@ -1,9 +1,35 @@
-from typing import Optional, List
+import os
+from typing import Callable, Optional, List
+from opentelemetry import trace
 from agents.agents import Agent
 from agents.deals import ScrapedDeal, DealSelection, Deal, Opportunity
 from agents.scanner_agent import ScannerAgent
 from agents.ensemble_agent import EnsembleAgent
 from agents.messaging_agent import MessagingAgent
+from agents.seen_deals import SeenDealIndex
+
+tracer = trace.get_tracer(__name__)
+
+
+def price_best_first(deals: List, upper: Callable, evaluate: Callable, threshold: float) -> List:
+    """
+    Fully evaluate deals in order of the upper bound of their discount, stopping once no remaining deal's bound
+    beats both the best discount so far and the threshold. The winner matches a full pass only if the bounds hold
+
+    :param upper: a deal's upper bound on its discount
+    :param evaluate: prices a deal in full, returning (result, discount)
+    :return: the results of the deals evaluated, best bound first
+    """
+    bounded = sorted(((upper(deal), deal) for deal in deals), key=lambda pair: pair[0], reverse=True)
+    results = []
+    best = threshold
+    for upper_discount, deal in bounded:
+        if upper_discount <= best:
+            break
+        result, discount = evaluate(deal)
+        results.append(result)
+        best = max(best, discount)
+    return results
 
 
 class DeterministicPlanningAgent(Agent):
@@ -11,14 +37,19 @@ class DeterministicPlanningAgent(Agent):
     name = "Deterministic Planning Agent"
     color = Agent.GREEN
     DISCOUNT_THRESHOLD = 50
+    ### Skip fully pricing deals whose cheap neural network bound can't win. The bound is empirical
+    ### (see EnsembleAgent.bounds), so this may rarely miss the deal a full pass would surface
+    BEST_FIRST = os.getenv("PLANNER_BEST_FIRST", "false").lower() == "true"
 
-    def __init__(self, collection):
+    def __init__(self, collection, seen: SeenDealIndex = None):
         """
         Create instances of the 3 Agents that this planner coordinates across
         :param collection: Chroma DB collection provided for the frontier model with RAG
+        :param seen: (Optional) index of deals already priced, so they're not scanned and priced again
         """
         self.log("Planning Agent is initializing...")
-        self.scanner = ScannerAgent()
+        self.seen = seen
+        self.scanner = ScannerAgent(seen=seen)
         self.ensemble = EnsembleAgent(collection)
         self.messanger = MessagingAgent()
         self.log("Planning Agent is ready!")
@@ -30,12 +61,37 @@ class DeterministicPlanningAgent(Agent):
         :return: an Opportunity pydantic model, containing the estimated value and discount
         """
         self.log(f"{self.name} is estimating how much the deal is worth...")
-        estimate: float = self.ensemble.price(deal.product_description)
-        discount = estimate - deal.price
+        with tracer.start_as_current_span("planner.deal", attributes={"deal.url": deal.url, "deal.price": deal.price}) as span:
+            estimate: float = self.ensemble.price(
+                deal.product_description, deal_price=deal.price, threshold=self.DISCOUNT_THRESHOLD
+            )
+            discount = estimate - deal.price
+            span.set_attribute("deal.discount", discount)
         self.log(f"{self.name} has processed a deal with discount ${discount:,.2f}!")
         return Opportunity(deal=deal, estimate=estimate, discount=discount)
 
 
+    def best_first(self, deals: List[Deal]) -> List[Opportunity]:
+        """
+        Price the deals best-first (see price_best_first), bounding each one's discount with the neural network alone
+        :param deals: the deals to consider
+        :return: the Opportunities of the deals that were fully priced
+        """
+        def upper(deal: Deal) -> float:
+            return self.ensemble.bounds(deal.product_description)[1] - deal.price
+
+        def evaluate(deal: Deal):
+            opportunity = self.run(deal)
+            return opportunity, opportunity.discount
+
+        opportunities = price_best_first(deals, upper, evaluate, self.DISCOUNT_THRESHOLD)
+        if len(opportunities) < len(deals):
+            self.log(f"{self.name} skipped {len(deals) - len(opportunities)} deals whose bound couldn't win")
+        ### Forget the bounds of the deals that were skipped
+        self.ensemble.prepriced.clear()
+        return opportunities
+
+
     def plan(self, memory: List[str] = None) -> Optional[Opportunity]:
         """
         Run the full workflow:
@@ -52,8 +108,18 @@ class DeterministicPlanningAgent(Agent):
         print("SELECTION:\n\n", selection)
 
         if selection:
-            ### Convert Deal objects into Opportunity objects
-            opportunities: List[Opportunity] = [self.run(deal) for deal in selection.deals[:5]]
+            deals = selection.deals[:5]
+            calls, saved = sum(self.ensemble.calls.values()), sum(self.ensemble.saved.values())
+            opportunities = self.best_first(deals) if self.BEST_FIRST else [self.run(deal) for deal in deals]
+            calls = sum(self.ensemble.calls.values()) - calls
+            saved = sum(self.ensemble.saved.values()) - saved
+            self.log(f"{self.name} fully priced {len(opportunities)} of {len(deals)} deals")
+            self.log(f"{self.name} made {calls} model calls and saved {saved} of {calls + saved} this run")
+            if self.seen is not None:
+                self.seen.update(deal.url for deal in deals)
+            if not opportunities:
+                self.log("Planning Agent has completed a run!")
+                return None
             ### Sort opportunities by discount to select an Opportunity with the largest discount amount
             opportunities.sort(key=lambda opp: opp.discount, reverse=True)
             best_opp = opportunities[0]
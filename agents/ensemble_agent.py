@@ -1,20 +1,54 @@
+import os
 import math
-import pandas as pd
-from PIL.ImageStat import Global
-from sklearn.linear_model import LinearRegression
-import joblib
+import time
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from opentelemetry import trace
 from agents.agents import Agent
 from agents.specialist_agent import SpecialistAgent
 from agents.frontier_agent import FrontierAgent
 from agents.neural_network_agent import NeuralNetworkAgent
-from typing import Optional
+from ensemble_combiner import EnsembleCombiner, COMBINER_PATH, MODELS
+from resilience import GuardedCall, DeadlineExceeded, breaker_for
+from typing import Dict, List, Optional, Tuple
+
+### Skip the specialist when the neural network and the frontier model agree within this difference of log prices
+### (0.1 is about 10%). 0 always calls every model
+AGREEMENT_TOLERANCE = float(os.getenv("ENSEMBLE_AGREEMENT_TOLERANCE", "0.1"))
+
+### Cascade mode: when pricing a deal, call the models cheapest first, and the next one only while the deal
+### could still beat the discount threshold
+CASCADE = os.getenv("ENSEMBLE_CASCADE", "false").lower() == "true"
+
+### How far the true price may be from the estimate after each stage, as a difference of log prices
+CASCADE_MARGINS = {"neural_network": 0.5, "frontier": 0.25}
+
+### How far above the neural network's estimate, as a difference of log prices, the ensemble's price is assumed
+### to stay when bounding deals. It's empirical, not guaranteed: python benchmark_ensemble.py bounds measures
+### the largest gap in the recordings and the margin that covers it
+BOUND_MARGIN = float(os.getenv("ENSEMBLE_BOUND_MARGIN", str(CASCADE_MARGINS["neural_network"])))
+
+tracer = trace.get_tracer(__name__)
 
 
 class EnsembleAgent(Agent):
     name = "Ensemble Agent"
     color = Agent.YELLOW
 
-    def __init__(self, collection):
+    def __init__(
+            self,
+            collection,
+            specialist=None,
+            frontier=None,
+            neural_network=None,
+            combiner_path: str = COMBINER_PATH,
+            combiner: EnsembleCombiner = None,
+            tolerance: float = AGREEMENT_TOLERANCE,
+            cascade: bool = CASCADE,
+            guarded: bool = True,
+    ):
         """
         Create an instance of Ensemble, by creating each of the models
         And loading the weights of the Ensemble
@@ -22,11 +56,41 @@ class EnsembleAgent(Agent):
         :param collection:
             A vector database collection used by the FrontierAgent with Chromadb for
             semantic retrieval and similarity search.
+        :param specialist, frontier, neural_network:
+            (Optional) models to use instead of creating the agents, e.g. recorded responses for benchmarks.
+            Anything with a price(description) -> float method will do
+        :param combiner_path: (Optional) the trained combiner; without one, the hand-coded weight bands are used
+        :param combiner: (Optional) a combiner to use instead of loading one, e.g. one fitted on a benchmark's training folds
+        :param tolerance: (Optional) how close the cheaper models must agree to skip the specialist
+        :param cascade: (Optional) stop calling models once a deal can no longer beat the discount threshold
+        :param guarded: (Optional) call the models with deadlines, hedges and circuit breakers; benchmarks turn this
+            off, so each model is called exactly once per estimate and its failures are raised, not skipped
         """
         self.log("Initializing Ensemble Agent...")
-        self.specialist = SpecialistAgent()
-        self.frontier = FrontierAgent(collection)
-        self.neural_network = NeuralNetworkAgent()
+        self.specialist = specialist or SpecialistAgent()
+        self.frontier = frontier or FrontierAgent(collection)
+        self.neural_network = neural_network or NeuralNetworkAgent()
+        if guarded:
+            ### Each model is called with its deadline, and the remote ones are hedged
+            self.guards = {name: GuardedCall(name, getattr(self, name).price) for name in MODELS}
+            ### A model that keeps failing is skipped for a while, and the others are reweighted
+            self.breakers = {name: breaker_for(name) for name in MODELS}
+        else:
+            self.guards = {name: getattr(self, name).price for name in MODELS}
+            self.breakers = {}
+        self.combiner = combiner or EnsembleCombiner.load(combiner_path)
+        self.tolerance = tolerance
+        self.cascade = cascade
+        ### Number of calls made to, and saved for, each model; the ensemble may price several deals at once
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.saved = Counter()
+        self.failed = Counter()
+        self.unavailable = Counter()
+        ### Neural network estimates made for bounds, reused when the same product is fully priced
+        self.prepriced: Dict[str, float] = {}
+        if self.combiner:
+            self.log(f"Ensemble Agent is using the trained {self.combiner.kind} combiner")
         self.log("Ensemble Agent is ready!")
 
     def estimate_price_range(
@@ -56,59 +120,251 @@ class EnsembleAgent(Agent):
             raise ValueError(f"Unknown contribution_option: {contribution_option}")
 
 
+    @staticmethod
+    def price_band(price: float) -> str:
+        """
+        The price band used to pick the weights of each model
+        """
+        if price < 100:
+            return "<100"
+        elif price < 200:
+            return "<200"
+        elif price < 300:
+            return "<300"
+        return "300+"
+
+    ### Apply a different pricing distribution depending on the estimated price range based on each model's best accuracy by range
+    ### Experiment Logs: https://docs.google.com/document/d/1RqaQeTpferlkdPNkXn1aEnrSq9d5uQs7cSWBWDS7As8/edit?tab=t.0
+
+    ### Simplified version of allocating model dominance
+    BAND_WEIGHTS = {
+        "<100": {"frontier": 0.7, "specialist": 0.3},
+        "<200": {"frontier": 0.85, "specialist": 0.1, "neural_network": 0.05},
+        "<300": {"frontier": 0.7, "specialist": 0.2, "neural_network": 0.1},
+        "300+": {"frontier": 0.9, "specialist": 0.1},
+    }
+
+    def combine(self, frontier: Optional[float], specialist: Optional[float], neural_network: Optional[float]) -> float:
+        """
+        Weight the estimates according to the price band of the rough price.
+        A missing estimate (None) is left out, and the weights of the others are scaled up to sum to 1
+
+        :return: the combined estimate
+        """
+        estimates = {"frontier": frontier, "specialist": specialist, "neural_network": neural_network}
+        available = {name: value for name, value in estimates.items() if value is not None}
+        if frontier is not None:
+            rough_price = self.estimate_price_range(frontier, specialist, "o3")
+        else:
+            rough_price = available.get("specialist", available.get("neural_network"))
+
+        weights = {name: weight for name, weight in self.BAND_WEIGHTS[self.price_band(rough_price)].items() if name in available}
+        total = sum(weights.values())
+        if not total:
+            return sum(available.values()) / len(available)
+        return sum(available[name] * weight for name, weight in weights.items()) / total
+
+
     ### Total Price Range Error for Each:
     frontier_err, special_err, neural_err = (0, 0, 0)
 
 
-    def price(self, description: str, y_truth: float=None) -> float:
+    @staticmethod
+    def processed(description: str) -> str:
+        return description.replace(
+            "How much does this cost to the nearest dollar?\n\n", ""
+        ).split("\n\nPrice is $")[0]
+
+    def agree(self, a: float, b: float) -> bool:
+        return self.tolerance > 0 and abs(math.log1p(max(a, 0)) - math.log1p(max(b, 0))) <= self.tolerance
+
+    def model_price(self, name: str, description: str) -> Optional[float]:
+        """
+        Ask one of the models to price the product, counting the call
+
+        :return: the estimate, or None if the model is unavailable, failed, or didn't answer in time
+        """
+        with tracer.start_as_current_span("ensemble.model", attributes={"model": name}) as span:
+            with self.lock:
+                cached = name == "neural_network" and description in self.prepriced
+                if cached:
+                    estimate = self.prepriced.pop(description)
+            span.set_attribute("cache_hit", cached)
+            if cached:
+                return estimate
+            breaker = self.breakers.get(name)
+            if breaker is not None and not breaker.allow():
+                with self.lock:
+                    self.unavailable[name] += 1
+                span.set_attribute("outcome", "unavailable")
+                self.log(f"Ensemble Agent - {name} is unavailable, combining the other models")
+                return None
+            with self.lock:
+                self.calls[name] += 1
+            start = time.monotonic()
+            try:
+                estimate = self.guards[name](description)
+            except Exception as e:
+                if breaker is None:
+                    raise
+                breaker.record(error=True)
+                with self.lock:
+                    self.failed[name] += 1
+                span.record_exception(e)
+                span.set_attribute("outcome", "timeout" if isinstance(e, DeadlineExceeded) else "failed")
+                reason = str(e) if isinstance(e, DeadlineExceeded) else f"{name} failed with {type(e).__name__}: {e}"
+                self.log(f"Ensemble Agent - {reason}, combining the other models")
+                return None
+            if breaker is not None:
+                breaker.record(time.monotonic() - start)
+            span.set_attribute("outcome", "priced")
+            return estimate
+
+    def bounds(self, description: str) -> Tuple[float, float]:
+        """
+        Cheap lower and upper bounds on the price of a product, from the local neural network alone, BOUND_MARGIN
+        either side of its estimate. They hold as far as the recordings show, but the ensemble can land outside them.
+        The estimate is kept, so pricing the same product in full doesn't run the network again
+
+        :return: (lower, upper)
+        """
+        description = self.processed(description)
+        estimate = self.model_price("neural_network", description)
+        if estimate is None:
+            return 0.0, math.inf
+        with self.lock:
+            self.prepriced[description] = estimate
+        log_estimate = math.log1p(max(estimate, 0))
+        return max(math.expm1(log_estimate - BOUND_MARGIN), 0), math.expm1(log_estimate + BOUND_MARGIN)
+
+    def estimates(self, description: str) -> Dict[str, float]:
+        """
+        Ask the models to price the product, cheapest first.
+        With a trained combiner, the specialist is skipped when the other two already agree
+
+        :return: the estimate of each model that was called
+        """
+        estimates = {}
+        for name in ("neural_network", "frontier"):
+            estimate = self.model_price(name, description)
+            if estimate is not None:
+                estimates[name] = estimate
+        if self.combiner and len(estimates) == 2 and self.agree(estimates["neural_network"], estimates["frontier"]):
+            self.log("Ensemble Agent - neural network and frontier agree, skipping the specialist")
+            with self.lock:
+                self.saved["specialist"] += 1
+        else:
+            estimate = self.model_price("specialist", description)
+            if estimate is not None:
+                estimates["specialist"] = estimate
+        if not estimates:
+            raise RuntimeError("None of the models could price the product")
+        return estimates
+
+    def cascade_estimates(self, description: str, deal_price: float, threshold: float) -> Dict[str, float]:
+        """
+        Ask the models to price the product, cheapest first, stopping as soon as even the optimistic end
+        of the estimate so far is not worth a discount above the threshold
+
+        :return: the estimate of each model that was called
+        """
+        estimates = {}
+        for stage, name in enumerate(MODELS):
+            estimate = self.model_price(name, description)
+            if estimate is not None:
+                estimates[name] = estimate
+            if stage == len(MODELS) - 1 or not estimates:
+                continue
+            logs = [math.log1p(max(value, 0)) for value in estimates.values()]
+            ### Disagreement between the models so far widens the margin
+            margin = CASCADE_MARGINS[name] + max(logs) - min(logs)
+            upper = math.expm1(math.log1p(max(self.combine_estimates(estimates), 0)) + margin)
+            if upper - deal_price <= threshold:
+                skipped = MODELS[stage + 1:]
+                with self.lock:
+                    self.saved.update(skipped)
+                self.log(f"Ensemble Agent - the discount is at most ${upper - deal_price:,.2f}, skipping {', '.join(skipped)}")
+                break
+        if not estimates:
+            raise RuntimeError("None of the models could price the product")
+        return estimates
+
+    def combine_estimates(self, estimates: Dict[str, float]) -> float:
+        """
+        Combine whichever estimates are available: with the trained combiner if there is one,
+        otherwise with the weight bands, reweighted over the models that answered
+        """
+        if self.combiner:
+            return float(self.combiner.predict({name: [value] for name, value in estimates.items()})[0])
+        return self.combine(estimates.get("frontier"), estimates.get("specialist"), estimates.get("neural_network"))
+
+    def price_all(self, descriptions: List[str], workers: int = 1) -> List[float]:
+        """
+        Price a batch of products, combining the estimates with one vectorised call per subset of models
+
+        :param descriptions: the descriptions of the products
+        :param workers: (Optional) the number of products whose models are called at the same time
+        :return: the estimates, in the order of the descriptions
+        """
+        processed = [self.processed(description) for description in descriptions]
+        if workers > 1 and len(processed) > 1:
+            ### Each worker runs in a copy of this context, so its spans stay in the caller's trace
+            contexts = [contextvars.copy_context() for _ in processed]
+            with ThreadPoolExecutor(max_workers=min(workers, len(processed))) as executor:
+                all_estimates = list(executor.map(
+                    lambda context, description: context.run(self.estimates, description), contexts, processed
+                ))
+        else:
+            all_estimates = [self.estimates(description) for description in processed]
+        if not self.combiner:
+            return [round(self.combine_estimates(estimates), 2) for estimates in all_estimates]
+
+        groups = defaultdict(list)
+        for i, estimates in enumerate(all_estimates):
+            groups[tuple(sorted(estimates))].append(i)
+        results = [0.0] * len(descriptions)
+        for subset, rows in groups.items():
+            predictions = {name: [all_estimates[i][name] for i in rows] for name in subset}
+            for i, combined in zip(rows, self.combiner.predict(predictions)):
+                results[i] = round(float(combined), 2)
+        return results
+
+    def price(self, description: str, y_truth: float=None, deal_price: float=None, threshold: float=None) -> float:
         """
         Run this ensemble model
-        Ask each of the models to price the product
-        Then use the Linear Regression model to return the weighted price
+        Ask the models to price the product
+        Then use the trained combiner, or the weight bands, to return the combined price
 
         :param
             description: the description of a product
             y_truth: the ground truth value(price) of a tested item, used for performance benchmark
+            deal_price, threshold: the price the product is offered at, and the discount worth surfacing;
+                in cascade mode, used to stop calling models for deals that can't make it
         :return: an estimate of its price
         """
 
         self.log("Running Ensemble Agent - collaborating with specialist, frontier and neural network agents...")
 
-        processed_desc = description.replace(
-            "How much does this cost to the nearest dollar?\n\n", ""
-        ).split("\n\nPrice is $")[0]
-
-        specialist = self.specialist.price(processed_desc)
-        frontier = self.frontier.price(processed_desc)
-        neural_network = self.neural_network.price(processed_desc)
-
-        rough_price = self.estimate_price_range(frontier, specialist, "o3")
-
-        ### Apply a different pricing distribution depending on the estimated price range based on each model's best accuracy by range
-        ### Experiment Logs: https://docs.google.com/document/d/1RqaQeTpferlkdPNkXn1aEnrSq9d5uQs7cSWBWDS7As8/edit?tab=t.0
-
-        ### Simplified version of allocating model dominance
-        if rough_price < 100:
-            combined = frontier * 0.7 + specialist * 0.3
-        elif rough_price < 200:
-            combined = frontier * 0.85 + specialist * 0.1 + neural_network * 0.05
-        elif rough_price < 300:
-            combined = frontier * 0.7 + specialist * 0.2 + neural_network * 0.1
-        else:
-            combined = frontier * 0.9 + specialist * 0.1
+        with tracer.start_as_current_span("ensemble.price") as span:
+            if self.cascade and deal_price is not None and threshold is not None:
+                estimates = self.cascade_estimates(self.processed(description), deal_price, threshold)
+            else:
+                estimates = self.estimates(self.processed(description))
+            combined = self.combine_estimates(estimates)
+            span.set_attribute("models", sorted(estimates))
+            span.set_attribute("estimate", combined)
 
         self.log(f"Ensemble Agent complete - returning ${combined:.2f}")
 
         ### This code below was made to check absolute error ranges for each model for testing/experiment purposes.
         ### At inference, this below doesn't affect the run.
         if y_truth is not None:
-            f_err = abs(frontier - y_truth)
-            s_err = abs(specialist - y_truth)
-            n_err = abs(neural_network - y_truth)
-
-            EnsembleAgent.frontier_err += f_err
-            EnsembleAgent.special_err += s_err
-            EnsembleAgent.neural_err += n_err
+            if "neural_network" in estimates:
+                EnsembleAgent.neural_err += abs(estimates["neural_network"] - y_truth)
+            if "frontier" in estimates:
+                EnsembleAgent.frontier_err += abs(estimates["frontier"] - y_truth)
+            if "specialist" in estimates:
+                EnsembleAgent.special_err += abs(estimates["specialist"] - y_truth)
 
             self.log(f"Frontier Err: {EnsembleAgent.frontier_err:,.2f}")
             self.log(f"Special Err: {EnsembleAgent.special_err:,.2f}")
@@ -1,11 +1,16 @@
 # imports
 
+import os
 import re
 from typing import List, Dict
-from openai import OpenAI
+from opentelemetry import trace
 from sentence_transformers import SentenceTransformer
 from agents.agents import Agent
+import vectorstore
+import openai_pool
+from resilience import DEADLINES
 
+tracer = trace.get_tracer(__name__)
 
 class FrontierAgent(Agent):
     name = "Frontier Agent"
@@ -13,16 +18,25 @@ class FrontierAgent(Agent):
 
     MODEL = "gpt-5-mini"
 
-    def __init__(self, collection):
+    ### "chroma" queries the collection; "numpy" uses the exported NumpyRagIndex (see rag_index.py)
+    RAG_BACKEND = os.getenv("RAG_BACKEND", "chroma")
+
+    def __init__(self, collection=None):
         """
         Set up this instance by connecting to OpenAI or DeepSeek, to the Chroma Datastore,
         And setting up the vector encoding model
+        :param collection: (Optional) the Chroma collection to search; the process-wide one by default
         """
         self.log("Initializing Frontier Agent...")
-        self.client = OpenAI()
+        self.client = openai_pool.client_for(self.name)
         self.MODEL = FrontierAgent.MODEL
         self.log("Frontier Agent is setting up with OpenAI")
-        self.collection = collection
+        self.collection = collection if collection is not None else vectorstore.get_collection()
+        self.index = None
+        if self.RAG_BACKEND == "numpy":
+            from rag_index import NumpyRagIndex
+            self.index = NumpyRagIndex()
+            self.log(f"Frontier Agent loaded the NumPy RAG index with {len(self.index):,} products")
         self.model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
         self.log("Frontier Agent is ready!")
 
@@ -63,9 +77,13 @@ class FrontierAgent(Agent):
         """
         self.log("Frontier Agent is performing a RAG search of the Chroma datastore to find 5 similar products")
         vector = self.model.encode([description])
-        results = self.collection.query(query_embeddings=vector.astype(float).tolist(), n_results=5)
-        documents = results['documents'][0][:]
-        prices = [m['price'] for m in results['metadatas'][0][:]]
+        with tracer.start_as_current_span("rag.query", attributes={"rag.backend": "numpy" if self.index is not None else "chroma"}):
+            if self.index is not None:
+                documents, prices = self.index.query(vector, k=5)[0]
+            else:
+                results = self.collection.query(query_embeddings=vector.astype(float).tolist(), n_results=5)
+                documents = results['documents'][0][:]
+                prices = [m['price'] for m in results['metadatas'][0][:]]
         self.log("Frontier Agent has found similar products")
         return documents, prices
 
@@ -89,7 +107,9 @@ class FrontierAgent(Agent):
         response = self.client.chat.completions.create(
             model=self.MODEL,
             messages=self.messages_for(description, documents, prices),
-            seed=42
+            seed=42,
+            ### Don't leave a request running past the time the ensemble waits for it
+            timeout=DEADLINES["frontier"],
         )
         reply = response.choices[0].message.content
         result = self.get_price(reply)
@@ -1,10 +1,14 @@
 import os
 import requests
 from typing import List
-from openai import OpenAI
+from opentelemetry import trace
 from openai.types.chat import ChatCompletionUserMessageParam
 from agents.agents import Agent
 from agents.deals import Opportunity
+import openai_pool
+
+tracer = trace.get_tracer(__name__)
+
 
 class MessagingAgent(Agent):
     ### PushOver API Post endpoint
@@ -18,7 +22,7 @@ class MessagingAgent(Agent):
         self.log(f"{self.name} is initializing...")
         self.pushover_user = os.getenv("PUSHOVER_USER")
         self.pushover_token = os.getenv("PUSHOVER_TOKEN")
-        self.openai = OpenAI()
+        self.openai = openai_pool.client_for(self.name)
         self.log(f"{self.name} is set!")
 
 
@@ -36,12 +40,16 @@ class MessagingAgent(Agent):
         "sound": "magic"
         }
 
-        if not payload["user"] or not payload["token"]:
-            self.log("Missing Pushover credentials")
-            return
+        with tracer.start_as_current_span("messaging.push") as span:
+            if not payload["user"] or not payload["token"]:
+                span.set_attribute("push.sent", False)
+                self.log("Missing Pushover credentials")
+                return
 
-        response = requests.post(self.PUSHOVER_URL, data=payload, headers=headers, timeout=5)
-        response.raise_for_status()
+            response = requests.post(self.PUSHOVER_URL, data=payload, headers=headers, timeout=5)
+            span.set_attribute("http.status_code", response.status_code)
+            response.raise_for_status()
+            span.set_attribute("push.sent", True)
 
 
     def alert(self, opportunity: Opportunity):
@@ -53,7 +61,8 @@ class MessagingAgent(Agent):
         text += f"Discount=${opportunity.discount:.2f}, "
         text += opportunity.deal.product_description[:10] + "..."
         text += opportunity.deal.url
-        self.push(text)
+        with tracer.start_as_current_span("messaging.alert", attributes={"deal.url": opportunity.deal.url}):
+            self.push(text)
         self.log("Messaging Agent has completed sending a push notification!")
 
 
@@ -74,10 +83,11 @@ class MessagingAgent(Agent):
             {"role": "user", "content": user_prompt}
         ]
 
-        response = self.openai.chat.completions.create(
-            model=self.MODEL,
-            messages=messages
-        )
+        with tracer.start_as_current_span("messaging.craft_message"):
+            response = self.openai.chat.completions.create(
+                model=self.MODEL,
+                messages=messages
+            )
 
         return response.choices[0].message.content
 
@@ -86,9 +96,10 @@ class MessagingAgent(Agent):
         """
         Make an alert about the specified details
         """
-        self.log(f"{self.name} is crafting a push notification message...")
-        message_text = self.craft_message(description, deal_price, estimated_true_value)
+        with tracer.start_as_current_span("messaging.notify", attributes={"deal.url": url}):
+            self.log(f"{self.name} is crafting a push notification message...")
+            message_text = self.craft_message(description, deal_price, estimated_true_value)
 
-        self.log(f"{self.name} is sending the notification message...")
-        self.push(message_text[:200] + "..." + url)
+            self.log(f"{self.name} is sending the notification message...")
+            self.push(message_text[:200] + "..." + url)
         self.log(f"{self.name} has completed!")
@@ -1,7 +1,11 @@
 from typing import Optional, List
-from openai import OpenAI
+from opentelemetry import trace
 from agents.deals import ScrapedDeal, DealSelection, Opportunity
 from agents.agents import Agent
+from agents.seen_deals import SeenDealIndex
+import openai_pool
+
+tracer = trace.get_tracer(__name__)
 
 
 class ScannerAgent(Agent):
@@ -27,9 +31,13 @@ class ScannerAgent(Agent):
     name = "Scanner Agent"
     color = Agent.CYAN
 
-    def __init__(self):
+    def __init__(self, seen: SeenDealIndex = None):
+        """
+        :param seen: (Optional) index of deals already priced or surfaced, which are skipped before their page is fetched
+        """
         self.log("Scanner Agent is initializing...")
-        self.openai = OpenAI()
+        self.openai = openai_pool.client_for(self.name)
+        self.seen = seen
         self.log("Scanner Agent is set!")
 
     def fetch_deals(self, memory) -> List[ScrapedDeal]:
@@ -38,8 +46,13 @@ class ScannerAgent(Agent):
         Return any brand-new deals that are not already in the memory provided
         """
         self.log("Scanner Agent is fetching available deals...")
-        urls = [opp.deal.url for opp in memory]
-        deals: List[ScrapedDeal] = ScrapedDeal.fetch()
+        skip = (lambda url: url in self.seen) if self.seen is not None else None
+        deals: List[ScrapedDeal] = ScrapedDeal.fetch(skip=skip)
+        ### A memory store answers this with an indexed lookup; a plain list of Opportunities is scanned
+        if hasattr(memory, "known_urls"):
+            urls = memory.known_urls(deal.url for deal in deals)
+        else:
+            urls = {opp.deal.url for opp in memory}
         results = [deal for deal in deals if deal.url not in urls]
         self.log(f"Scanner Agent received {len(results)} new fresh deals!")
         return results
@@ -64,30 +77,33 @@ class ScannerAgent(Agent):
         if memory is None:
             memory = []
 
-        scraped_deals = self.fetch_deals(memory)
-
-        if scraped_deals:
-            messages = [
-                {"role": "system", "content": self.SYSTEM_PROMPT},
-                {"role": "user", "content": self.make_user_prompt(scraped_deals)}
-            ]
-
-            self.log("Scanner Agent is calling OpenAI client...")
-            response = self.openai.chat.completions.parse(
-                model=self.MODEL,
-                messages=messages,
-                response_format=DealSelection,
-                reasoning_effort="minimal"
-            )
-
-            result = response.choices[0].message.parsed
-            result.deals = [deal for deal in result.deals if deal.price > 0]
-            self.log(
-                f"Scanner Agent received {len(result.deals)} selected deals with price>0 from OpenAI"
-            )
-
-            return result
-        return None
+        with tracer.start_as_current_span("scanner.scan") as span:
+            scraped_deals = self.fetch_deals(memory)
+            span.set_attribute("deals.scraped", len(scraped_deals))
+
+            if scraped_deals:
+                messages = [
+                    {"role": "system", "content": self.SYSTEM_PROMPT},
+                    {"role": "user", "content": self.make_user_prompt(scraped_deals)}
+                ]
+
+                self.log("Scanner Agent is calling OpenAI client...")
+                response = self.openai.chat.completions.parse(
+                    model=self.MODEL,
+                    messages=messages,
+                    response_format=DealSelection,
+                    reasoning_effort="minimal"
+                )
+
+                result = response.choices[0].message.parsed
+                result.deals = [deal for deal in result.deals if deal.price > 0]
+                span.set_attribute("deals.selected", len(result.deals))
+                self.log(
+                    f"Scanner Agent received {len(result.deals)} selected deals with price>0 from OpenAI"
+                )
+
+                return result
+            return None
 
 
     def test_scan(self, memory: List[Opportunity] = None) -> Optional[DealSelection]:
@@ -0,0 +1,149 @@
+import os
+import re
+import json
+import math
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterable
+from urllib.parse import urlsplit
+
+### dealnews URLs end with the id of the deal (or of the product, under /products/), e.g. .../21663266.html
+DEALNEWS_ID = re.compile(r"/(\d+)\.html$")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Reduce a URL to what identifies the page: no scheme, "www.", query string (e.g. ?iref=rss-c142), fragment or trailing slash
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/") or "/"
+    return f"{host}{path}"
+
+
+def deal_key(url: str) -> str:
+    """
+    Return the key a deal is deduplicated by: its dealnews id when there is one, otherwise its normalized URL.
+    The same deal reached through different category feeds gets the same key
+    """
+    normalized = normalize_url(url)
+    host, _, path = normalized.partition("/")
+    match = DEALNEWS_ID.search(normalized)
+    if host.endswith("dealnews.com") and match:
+        kind = "product" if path.startswith("products/") else "deal"
+        return f"dealnews:{kind}:{match.group(1)}"
+    return normalized
+
+
+class BloomFilter:
+    """
+    A fixed-size probabilistic set: no false negatives, and false positives at about error_rate once it holds capacity keys
+    """
+
+    def __init__(self, capacity: int, error_rate: float, bits: bytes = None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits else bytearray((self.size + 7) // 8)
+
+    def positions(self, key: str):
+        """
+        Derive the bit positions of a key from one digest (Kirsch-Mitzenmacher double hashing)
+        """
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class SeenDealIndex:
+    """
+    Remember every deal that has been priced or surfaced, so it isn't priced again when it shows up
+    with another tracking parameter or in another category feed.
+    Recent deals are kept in an exact, bounded set; the full history lives in a Bloom filter of fixed size,
+    so lookups are O(1) and memory stays flat however long the scanner runs.
+    """
+
+    CAPACITY = 200_000
+    ERROR_RATE = 0.001
+    RECENT_SIZE = 5_000
+
+    def __init__(self, path: str = None, capacity: int = CAPACITY, error_rate: float = ERROR_RATE, recent_size: int = RECENT_SIZE):
+        """
+        Create the index, loading it from path if it has been saved before
+
+        :param path: (Optional) JSON file the index is persisted to
+        :param capacity: the number of deals the Bloom filter is sized for
+        :param error_rate: the false positive rate of the Bloom filter at capacity
+        :param recent_size: the number of most recent deals kept in the exact set
+        """
+        self.path = path
+        self.recent_size = recent_size
+        self.lock = threading.Lock()
+        self.recent: OrderedDict[str, None] = OrderedDict()
+        bits = None
+
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            ### A filter sized differently can't be reused; start again rather than give wrong answers
+            if data["capacity"] == capacity and data["error_rate"] == error_rate:
+                bits = base64.b64decode(data["bits"])
+                self.recent.update((key, None) for key in data["recent"][-recent_size:])
+
+        self.bloom = BloomFilter(capacity, error_rate, bits)
+
+    @property
+    def empty(self) -> bool:
+        return not self.recent
+
+    def __contains__(self, url: str) -> bool:
+        key = deal_key(url)
+        with self.lock:
+            return key in self.recent or key in self.bloom
+
+    def add(self, url: str) -> None:
+        self.update([url])
+
+    def update(self, urls: Iterable[str]) -> None:
+        """
+        Mark the deals at these URLs as seen
+        """
+        with self.lock:
+            for url in urls:
+                key = deal_key(url)
+                self.bloom.add(key)
+                self.recent[key] = None
+                self.recent.move_to_end(key)
+                if len(self.recent) > self.recent_size:
+                    self.recent.popitem(last=False)
+
+    def save(self) -> None:
+        """
+        Persist the index atomically
+        """
+        if not self.path:
+            return
+        with self.lock:
+            data = {
+                "capacity": self.bloom.capacity,
+                "error_rate": self.bloom.error_rate,
+                "bits": base64.b64encode(bytes(self.bloom.bits)).decode(),
+                "recent": list(self.recent),
+            }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
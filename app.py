@@ -1,122 +1,126 @@
-import logging
-import queue
+import os
+import asyncio
 import threading
-import time
 import gradio as gr
 import plotly.graph_objects as go
 from dotenv import load_dotenv
-from typing import Tuple
+from typing import Dict, Tuple
 
 ### Internal classes
 from deal_agent_framework import DealAgentFramework
 from log_utils import reformat
+from plot_data import compact
+from run_scheduler import RunScheduler
+from event_bus import bus, install_log_handler, AsyncSubscription, LOG, RESULT
 
 load_dotenv(override=True)
 
-class QueueHandler(logging.Handler):
-    def __init__(self, log_queue):
-        super().__init__()
-        self.log_queue = log_queue
+PLOT_DATAPOINTS = int(os.getenv("PLOT_DATAPOINTS", 800))
 
-    def emit(self, record):
-        self.log_queue.put(self.format(record))
+### Log lines shown per session; the log grows to LOG_LIMIT lines before it's cut back to the last LOG_LINES
+LOG_LINES = 18
+LOG_LIMIT = 2 * LOG_LINES
 
+### Seconds a session waits for events before checking again that it's still open; closing it also wakes it
+SESSION_WAIT = 30
 
 def html_for(log_data):
-    output = "<br>".join(log_data[-18:])
-    return f"""
-    <div id="scrollContent" style="height: 400px; overflow-y: auto; border: 1px solid #ccc; background-color: #222229; padding: 10px;">
-    {output}
-    </div>
-    """
+    ### log_data holds lines already converted to HTML. Each ends with its own <br>, so new lines only extend
+    ### the HTML, and Gradio streams a generator's output as a diff: just the appended lines are sent
+    return "".join(f"{line}<br>" for line in log_data)
 
-def setup_logging(log_queue):
+def table_for(opps):
     """
-    Register and configure for logging
+    Format the initial/final_result
     """
-    logger = logging.getLogger()
-
-    ### Remove previous QueueHandlers to avoid duplication and UI floods (handler duplication)
-    for h in list(logger.handlers):
-        if isinstance(h, QueueHandler):
-            logger.removeHandler(h)
-
-    handler = QueueHandler(log_queue)
-    formatter = logging.Formatter(
-        "[%(asctime)s] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S %z",
-    )
-    handler.setFormatter(formatter)
-
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
-
+    return [
+        [
+            opp.deal.product_description,
+            f"${opp.deal.price:.2f}",
+            f"${opp.estimate:.2f}",
+            f"${opp.discount:.2f}",
+            opp.deal.url,
+        ]
+        for opp in opps
+    ]
 
 class App:
 
     def __init__(self):
         ### lazy initialization
         self.agent_framework = None
-        self.timer_enabled = False
+        self.lock = threading.Lock()
+        ### Owns the runs: one at a time, every RUN_INTERVAL_SECONDS, shared by every browser tab
+        self.scheduler = RunScheduler(self.do_run)
+        self.scheduler.subscribe(lambda table: bus.publish(RESULT, table))
+        ### The bus subscription of each open browser session, closed when the tab is
+        self.sessions: Dict[str, AsyncSubscription] = {}
 
 
     ### And assign it here
     def get_agent_framework(self):
-        if not self.agent_framework:
-            self.agent_framework = DealAgentFramework()
+        with self.lock:
+            if not self.agent_framework:
+                self.agent_framework = DealAgentFramework()
 
         return self.agent_framework
 
+    def memory_table(self):
+        agent_framework = self.get_agent_framework()
+        return table_for(agent_framework.memory.recent(agent_framework.MEMORY_PAGE_SIZE))
+
+    def do_run(self):
+        new_opportunities = self.get_agent_framework().run()
+        table = table_for(new_opportunities)
+        return table
+
     def run(self):
         with gr.Blocks(
                 title="WorthBrain",
                 fill_width=True,
-                css="footer {visibility: hidden}"
+                css="footer {visibility: hidden} #logs {height: 400px; overflow-y: auto; border: 1px solid #ccc; background-color: #222229; padding: 10px;}"
         ) as ui:
             log_data = gr.State([])
 
-            def table_for(opps):
+            async def stream_ui_updates(log_data, subscription):
                 """
-                Format the initial/final_result
+                An async generator loop that streams log messages and opportunities data for the data frame in the UI,
+                for as long as the session is open. It awaits events without holding a thread, and each burst
+                of them makes a single update, which only sends the outputs that changed, and of the log only the new lines
                 """
-                return [
-                    [
-                        opp.deal.product_description,
-                        f"${opp.deal.price:.2f}",
-                        f"${opp.estimate:.2f}",
-                        f"${opp.discount:.2f}",
-                        opp.deal.url,
-                    ]
-                    for opp in opps
-                ]
-
-            def stream_ui_updates(log_data, log_queue, result_queue):
-                """
-                A generator loop that streams log messages and opportunities data for the data frame in the UI
-                """
-
-                initial_result = table_for(self.get_agent_framework().memory)
-                final_result = None
 
-                while True:
-                    try:
-                        message = log_queue.get_nowait()
-                        log_data.append(reformat(message))
-                        yield log_data, html_for(log_data), final_result or initial_result
-                    except queue.Empty:
-                        try:
-                            final_result = result_queue.get_nowait()
-                            yield log_data, html_for(log_data), final_result or initial_result
-                        except queue.Empty:
-                            if final_result is not None:
-                                break
-                            time.sleep(0.1)
+                latest = self.scheduler.latest
+                if latest is None:
+                    ### Loading the framework and reading the memory block, so they run off the event loop
+                    latest = await asyncio.to_thread(self.memory_table)
+                yield log_data, html_for(log_data), latest
+
+                while not subscription.closed:
+                    events = await subscription.drain(timeout=SESSION_WAIT)
+                    if not events:
+                        continue
+                    new_result = None
+                    ### Only the lines that will be shown are converted
+                    lines = [event.data for event in events if event.topic == LOG][-LOG_LINES:]
+                    log_data.extend(reformat(line) for line in lines)
+                    if len(log_data) > LOG_LIMIT:
+                        ### The only full resend, at most once per LOG_LINES new lines
+                        del log_data[:-LOG_LINES]
+                    for event in events:
+                        if event.topic == RESULT:
+                            new_result = event.data
+                    yield (
+                        log_data,
+                        html_for(log_data) if lines else gr.skip(),
+                        new_result if new_result is not None else gr.skip(),
+                    )
 
             def get_plot():
                 """
                 Create 3D scatter plot for the result data
                 """
-                documents, vectors, colors = DealAgentFramework.get_plot_data(max_datapoints=800)
+                documents, vectors, colors = DealAgentFramework.get_plot_data(max_datapoints=PLOT_DATAPOINTS)
+                vectors = compact(vectors)
 
                 fig = go.Figure(
                     data=[
@@ -126,6 +130,7 @@ class App:
                             z=vectors[:, 2],
                             mode="markers",
                             marker=dict(size=2, color=colors, opacity=0.7),
+                            hoverinfo="skip",
                         )
                     ]
                 )
@@ -148,41 +153,33 @@ class App:
                 return fig
 
 
-            def do_run():
-                new_opportunities = self.get_agent_framework().run()
-                table = table_for(new_opportunities)
-                return table
-
-            def run_with_logging(initial_log_data):
+            async def follow_runs(initial_log_data, request: gr.Request):
                 """
-                Load event handler that starts a background worker thread, streaming log updates
-                to the UI and yields incremental UI updates.
+                Load event handler that subscribes this session to the scheduler's runs, streaming log updates
+                to the UI and yielding incremental UI updates. It never starts a run itself.
                 :yield:
                     Tuple containing:
                     - log_data (persistent log state)
                     - output (HTML-formatted log message)
                     - final_result (table data for opportunities)
                 """
-                log_queue = queue.Queue()
-                result_queue = queue.Queue()
-                setup_logging(log_queue)
-
-                def worker():
-                    """
-                    Background task that executes the agent framework,
-                    sends final results to result_queue, and emits logs
-                    through the logging system.
-                    """
-                    result = do_run()
-                    result_queue.put(result)
-
-                thread = threading.Thread(target=worker, daemon=True)
-                thread.start()
+                ### Closed with the session, by close_session
+                with bus.subscribe_async([LOG, RESULT]) as subscription:
+                    self.sessions[request.session_hash] = subscription
+                    try:
+                        async for log_data, html_output, final_result in stream_ui_updates(initial_log_data, subscription):
+                            yield log_data, html_output, final_result
+                    finally:
+                        if self.sessions.get(request.session_hash) is subscription:
+                            del self.sessions[request.session_hash]
 
-                for log_data, html_output, final_result in stream_ui_updates(
-                    initial_log_data, log_queue, result_queue
-                    ):
-                    yield log_data, html_output, final_result
+            def close_session(request: gr.Request):
+                """
+                Unload event handler: the tab was closed or reloaded, so its stream stops and its subscription goes
+                """
+                subscription = self.sessions.pop(request.session_hash, None)
+                if subscription is not None:
+                    subscription.close()
 
             with gr.Row():
                 gr.Markdown(
@@ -213,9 +210,10 @@ class App:
 
             with gr.Row():
                 with gr.Column(scale=1):
-                    logs = gr.HTML()
+                    logs = gr.HTML(elem_id="logs")
                 with gr.Column(scale=1):
-                    plot = gr.Plot(value=get_plot(), show_label=False)
+                    ### Filled in by ui.load, so the page doesn't wait on the projection
+                    plot = gr.Plot(show_label=False)
 
             ### Footer
             with gr.Row():
@@ -232,23 +230,25 @@ class App:
                     """
                 )
 
+            ui.load(get_plot, outputs=[plot])
+
             ui.load(
                 ### connect a load event handler
-                run_with_logging,
+                follow_runs,
                 ### set inputs
                 inputs=[log_data],
                 ### set outputs
-                outputs=[log_data, logs, opportunities_dataframe]
-            )
-
-            ### Set timer to re-run the program every N-minutes
-            timer = gr.Timer(value=600, active=self.timer_enabled)
-            timer.tick(
-                run_with_logging,
-                inputs=[log_data],
                 outputs=[log_data, logs, opportunities_dataframe],
+                ### Every session follows the runs for as long as it's open, so none may queue behind another;
+                ### an idle session is only an awaiting coroutine, so this holds no worker thread per tab
+                concurrency_limit=None,
             )
+            ui.unload(close_session)
 
+        ### Warm the projection cache while the server starts up
+        threading.Thread(target=DealAgentFramework.get_plot_data, kwargs={"max_datapoints": PLOT_DATAPOINTS}, daemon=True).start()
+        install_log_handler()
+        self.scheduler.start()
         ui.launch(inbrowser=True)
 
 
@@ -0,0 +1,429 @@
+"""
+Latency and accuracy benchmark of the Ensemble Agent and each of its models.
+
+Record the responses of the live models once, over a fixed set of items:
+    python benchmark_ensemble.py record test.arrow --limit 250
+
+Then replay them offline, as often as needed, e.g. on every commit:
+    python benchmark_ensemble.py replay
+
+Or measure the calls saved by the cascade mode, and what it costs in accuracy:
+    python benchmark_ensemble.py cascade
+
+Or check the neural network bounds that best-first pricing prunes deals by (PLANNER_BEST_FIRST):
+    python benchmark_ensemble.py bounds
+
+The trained combiner is fitted on these same recordings, so with one in place, replay and cascade
+cross-validate it (--folds, 5 by default): each item is priced by a combiner fitted on the other folds.
+
+The recordings hold the items, and each model's price and latency per item, so a replay makes no
+network calls and measures the ensemble itself against the recorded model latencies.
+The models are called without the ensemble's deadlines, hedges and circuit breakers, so every model
+answers every item exactly once, and a replay's call counts are the same on every run.
+The report is JSON: latency percentiles, throughput, error per price band and overall, per model and combined.
+"""
+
+import os
+import json
+import time
+import hashlib
+import random
+import argparse
+import math
+import subprocess
+from collections import Counter
+from typing import Dict, List, Optional
+import numpy as np
+### Internal classes
+from agents.ensemble_agent import EnsembleAgent, BOUND_MARGIN
+from ensemble_combiner import EnsembleCombiner, MODELS
+
+RECORDINGS = os.path.join("benchmarks", "recordings.json")
+REPORT = os.path.join("benchmarks", "report.json")
+PERCENTILES = (50, 90, 95, 99)
+### A trained combiner is refitted per fold and scored on the items it wasn't fitted on
+FOLDS = 5
+
+
+def description_key(description: str) -> str:
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def load_items(path: str, limit: int = None) -> List[dict]:
+    """
+    Load a fixed item set as {"description", "price"} dicts: from a JSON list of them,
+    or from curated Items (.arrow, .parquet or a pickle)
+    """
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            items = json.load(f)
+    else:
+        from prototypes.build_vectorstore import iter_items, description
+        items = [{"description": description(item), "price": item.price} for item in iter_items(path)]
+    return items[:limit] if limit else items
+
+
+class Recorder:
+    """
+    Wraps a live model, recording the price and latency of each call
+    """
+
+    def __init__(self, model, responses: Dict[str, dict]):
+        self.model = model
+        self.responses = responses
+        self.calls: List[dict] = []
+
+    def price(self, description: str) -> float:
+        start = time.perf_counter()
+        price = self.model.price(description)
+        response = {"price": price, "latency": time.perf_counter() - start}
+        self.responses[description_key(description)] = response
+        self.calls.append(response)
+        return price
+
+
+class Replayer:
+    """
+    Stands in for a model, answering with its recorded responses
+    """
+
+    def __init__(self, name: str, responses: Dict[str, dict]):
+        self.name = name
+        self.responses = responses
+        self.calls: List[dict] = []
+
+    def price(self, description: str) -> float:
+        key = description_key(description)
+        if key not in self.responses:
+            raise KeyError(f"No recorded {self.name} response for this item - record the item set again")
+        response = self.responses[key]
+        self.calls.append(response)
+        return response["price"]
+
+
+def latency_stats(latencies: List[float]) -> dict:
+    latencies = np.asarray(latencies)
+    stats = {f"p{p}": float(np.percentile(latencies, p)) for p in PERCENTILES}
+    stats["mean"] = float(latencies.mean())
+    stats["max"] = float(latencies.max())
+    return stats
+
+
+def error_stats(guesses: List[float], truths: List[float]) -> dict:
+    """
+    Mean absolute error and RMSLE, overall and per price band of the true price
+    """
+    guesses, truths = np.asarray(guesses, dtype=float), np.asarray(truths, dtype=float)
+    errors = np.abs(guesses - truths)
+    log_errors = (np.log1p(np.maximum(guesses, 0)) - np.log1p(truths)) ** 2
+    bands = np.array([EnsembleAgent.price_band(truth) for truth in truths])
+
+    stats = {"mae": float(errors.mean()), "rmsle": float(np.sqrt(log_errors.mean())), "bands": {}}
+    for band in ("<100", "<200", "<300", "300+"):
+        mask = bands == band
+        if mask.any():
+            stats["bands"][band] = {
+                "count": int(mask.sum()),
+                "mae": float(errors[mask].mean()),
+                "rmsle": float(np.sqrt(log_errors[mask].mean())),
+            }
+    return stats
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fit_combiner(recordings: dict, rows: List[int] = None, kind: str = "linear") -> EnsembleCombiner:
+    """
+    Fit a combiner on the recorded responses for some of the items, all of them by default
+    """
+    items = recordings["items"] if rows is None else [recordings["items"][i] for i in rows]
+    keys = [description_key(item["description"]) for item in items]
+    predictions = {name: [recordings["responses"][name][key]["price"] for key in keys] for name in MODELS}
+    return EnsembleCombiner.fit(predictions, [item["price"] for item in items], kind)
+
+
+def out_of_fold_combiners(recordings: dict, folds: int = FOLDS, seed: int = 42) -> Optional[List[EnsembleCombiner]]:
+    """
+    For each recorded item, a combiner of the trained kind fitted on the other folds, so the error reported
+    for it is measured on an item the combiner never saw
+
+    :return: one combiner per item; None without a trained combiner (the weight bands aren't fitted) or folds < 2
+    """
+    trained = EnsembleCombiner.load()
+    if trained is None or folds < 2:
+        return None
+    count = len(recordings["items"])
+    order = random.Random(seed).sample(range(count), count)
+    fold_of = {row: position % folds for position, row in enumerate(order)}
+    fitted = [
+        fit_combiner(recordings, [row for row in range(count) if fold_of[row] != fold], trained.kind)
+        for fold in range(folds)
+    ]
+    return [fitted[fold_of[row]] for row in range(count)]
+
+
+def run_benchmark(
+        items: List[dict],
+        models: Dict[str, object],
+        mode: str,
+        combiners: List[EnsembleCombiner] = None,
+        **ensemble_options,
+) -> dict:
+    """
+    Price every item with an Ensemble Agent over the given models and summarise the results
+
+    :param items: the fixed item set
+    :param models: a Recorder or Replayer for each of MODELS
+    :param mode: "record" or "replay", noted in the report
+    :param combiners: (Optional) the combiner to price each item with, e.g. out-of-fold ones; the trained one by default
+    :param ensemble_options: passed on to the Ensemble Agent, e.g. tolerance
+    """
+    combiners = combiners or [None] * len(items)
+    ### One ensemble per combiner; they share the models, and so their calls
+    ensembles = {}
+    for combiner in combiners:
+        if id(combiner) not in ensembles:
+            ensembles[id(combiner)] = EnsembleAgent(None, **models, combiner=combiner, guarded=False, **ensemble_options)
+    ensemble = ensembles[id(combiners[0])]
+    truths = [item["price"] for item in items]
+    estimates, overheads, latencies = [], [], []
+    ### The items each model was called for; the ensemble may skip a model
+    called = {name: [] for name in models}
+
+    for i, item in enumerate(items):
+        before = {name: len(model.calls) for name, model in models.items()}
+        start = time.perf_counter()
+        estimates.append(ensembles[id(combiners[i])].price(item["description"]))
+        elapsed = time.perf_counter() - start
+        new_calls = [call for name, model in models.items() for call in model.calls[before[name]:]]
+        for name, model in models.items():
+            called[name].extend([i] * (len(model.calls) - before[name]))
+        ### The ensemble's own time, excluding the models; in a replay the models take no time at all
+        model_time = sum(call["latency"] for call in new_calls)
+        overhead = max(elapsed - model_time, 0) if mode == "record" else elapsed
+        overheads.append(overhead)
+        ### The models are called one after another, so an ensemble call takes the sum of their latencies
+        latencies.append(overhead + model_time)
+
+    report = {"commit": current_commit(), "mode": mode, "items": len(items), "models": {}}
+    for name, model in models.items():
+        model_latencies = [call["latency"] for call in model.calls]
+        report["models"][name] = {
+            "calls": len(model.calls),
+            "calls_per_item": len(model.calls) / len(items),
+        }
+        if model.calls:
+            report["models"][name].update({
+                "latency": latency_stats(model_latencies),
+                "throughput": len(model_latencies) / sum(model_latencies) if sum(model_latencies) else None,
+                "error": error_stats([call["price"] for call in model.calls], [truths[i] for i in called[name]]),
+            })
+
+    ensemble_latencies = np.asarray(latencies)
+    report["ensemble"] = {
+        "combiner": ensemble.combiner.kind if ensemble.combiner else "bands",
+        "folds": len(ensembles) if len(ensembles) > 1 else None,
+        "calls_per_item": sum(len(model.calls) for model in models.values()) / len(items),
+        "latency": latency_stats(ensemble_latencies),
+        "overhead": latency_stats(overheads),
+        "throughput": len(items) / ensemble_latencies.sum(),
+        "error": error_stats(estimates, truths),
+    }
+    return report
+
+
+def record(items: List[dict], recordings_path: str = RECORDINGS) -> dict:
+    """
+    Benchmark the live models, saving their responses and the item set for later replays
+    """
+    import vectorstore
+
+    live = EnsembleAgent(vectorstore.get_collection(), guarded=False)
+    responses = {name: {} for name in MODELS}
+    models = {name: Recorder(getattr(live, name), responses[name]) for name in MODELS}
+    ### Every model is called for every item, so the recordings can replay any policy and train the combiner
+    report = run_benchmark(items, models, "record", tolerance=0)
+
+    os.makedirs(os.path.dirname(recordings_path) or ".", exist_ok=True)
+    tmp_path = recordings_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"items": items, "responses": responses}, f)
+    os.replace(tmp_path, recordings_path)
+    return report
+
+
+def replay(recordings_path: str = RECORDINGS, folds: int = FOLDS) -> dict:
+    """
+    Benchmark the ensemble offline, against the recorded responses, cross-validating a trained combiner
+    """
+    with open(recordings_path, "r") as f:
+        recordings = json.load(f)
+    models = {name: Replayer(name, recordings["responses"][name]) for name in MODELS}
+    return run_benchmark(recordings["items"], models, "replay", out_of_fold_combiners(recordings, folds))
+
+
+def compare_cascade(recordings_path: str = RECORDINGS, threshold: float = 50, seed: int = 42, folds: int = FOLDS) -> dict:
+    """
+    Replay the recordings through the full ensemble and through the cascade, as if each item were a deal.
+    Items without a "deal_price" are offered at a random discount of up to 60%, with a fixed seed.
+    A trained combiner is cross-validated, as in replay
+
+    :return: the model calls of each, and the cascade's accuracy impact: the errors, and the deals whose
+        decision (surfaced or not, at this discount threshold) changed
+    """
+    with open(recordings_path, "r") as f:
+        recordings = json.load(f)
+    items = recordings["items"]
+    rng = random.Random(seed)
+    deal_prices = [item.get("deal_price", item["price"] * rng.uniform(0.4, 1.0)) for item in items]
+
+    combiners = out_of_fold_combiners(recordings, folds, seed) or [None] * len(items)
+    full, cascade = {}, {}
+    for combiner in combiners:
+        if id(combiner) not in full:
+            for ensembles, cascade_mode in ((full, False), (cascade, True)):
+                models = {name: Replayer(name, recordings["responses"][name]) for name in MODELS}
+                ensembles[id(combiner)] = EnsembleAgent(
+                    None, **models, combiner=combiner, tolerance=0, cascade=cascade_mode, guarded=False
+                )
+
+    full_estimates = [full[id(combiner)].price(item["description"]) for item, combiner in zip(items, combiners)]
+    cascade_estimates = [
+        cascade[id(combiner)].price(item["description"], deal_price=deal_price, threshold=threshold)
+        for item, deal_price, combiner in zip(items, deal_prices, combiners)
+    ]
+    full_calls = sum((ensemble.calls for ensemble in full.values()), Counter())
+    cascade_calls = sum((ensemble.calls for ensemble in cascade.values()), Counter())
+    saved = sum(sum(ensemble.saved.values()) for ensemble in cascade.values())
+
+    truths = [item["price"] for item in items]
+    full_winners = {i for i, (e, p) in enumerate(zip(full_estimates, deal_prices)) if e - p > threshold}
+    cascade_winners = {i for i, (e, p) in enumerate(zip(cascade_estimates, deal_prices)) if e - p > threshold}
+    true_winners = {i for i, (t, p) in enumerate(zip(truths, deal_prices)) if t - p > threshold}
+    return {
+        "commit": current_commit(),
+        "items": len(items),
+        "threshold": threshold,
+        "folds": len(full) if len(full) > 1 else None,
+        "calls": {"full": dict(full_calls), "cascade": dict(cascade_calls)},
+        "calls_saved": saved,
+        "calls_saved_fraction": saved / sum(full_calls.values()),
+        "error": {"full": error_stats(full_estimates, truths), "cascade": error_stats(cascade_estimates, truths)},
+        "winners": {
+            "true": len(true_winners),
+            "full": len(full_winners),
+            "cascade": len(cascade_winners),
+            "missed_by_cascade": len(full_winners - cascade_winners),
+            "added_by_cascade": len(cascade_winners - full_winners),
+            "true_missed_by_cascade": len(true_winners & full_winners - cascade_winners),
+        },
+    }
+
+
+def compare_best_first(
+        recordings_path: str = RECORDINGS,
+        threshold: float = 50,
+        seed: int = 42,
+        batch: int = 5,
+        slack: float = 0.05,
+        folds: int = FOLDS,
+) -> dict:
+    """
+    Check the bounds of best-first pricing against the recordings: how far above the neural network's estimate
+    the full ensemble lands, and whether pruning surfaces the same deal as pricing every deal of a run.
+    Runs are batches of items offered at random discounts, as in compare_cascade
+
+    :param batch: the deals per run
+    :param slack: added to the largest gap seen, for the margin to set
+    :return: the log gaps, the margin to set as ENSEMBLE_BOUND_MARGIN, and for the current margin and that one,
+        the runs whose surfaced deal changed and the full pricings saved
+    """
+    from agents.deterministic_planning_agent import price_best_first
+
+    with open(recordings_path, "r") as f:
+        recordings = json.load(f)
+    items = recordings["items"]
+    rng = random.Random(seed)
+    deal_prices = [item.get("deal_price", item["price"] * rng.uniform(0.4, 1.0)) for item in items]
+    combiners = out_of_fold_combiners(recordings, folds, seed) or [None] * len(items)
+    ensembles = {}
+    for combiner in combiners:
+        if id(combiner) not in ensembles:
+            models = {name: Replayer(name, recordings["responses"][name]) for name in MODELS}
+            ensembles[id(combiner)] = EnsembleAgent(None, **models, combiner=combiner, tolerance=0, cascade=False, guarded=False)
+    estimates = [ensembles[id(combiner)].price(item["description"]) for item, combiner in zip(items, combiners)]
+    networks = [recordings["responses"]["neural_network"][description_key(item["description"])]["price"] for item in items]
+
+    gaps = np.log1p(np.maximum(estimates, 0)) - np.log1p(np.maximum(networks, 0))
+    recommended = float(gaps.max()) + slack
+    order = rng.sample(range(len(items)), len(items))
+    runs = [order[start:start + batch] for start in range(0, len(order), batch)]
+
+    def surfaced(discounts):
+        best = max(discounts, key=discounts.get, default=None)
+        return best if best is not None and discounts[best] > threshold else None
+
+    def check(margin):
+        changed, saved = 0, 0
+        for run in runs:
+            discounts = {i: estimates[i] - deal_prices[i] for i in run}
+            priced = price_best_first(
+                run,
+                lambda i: math.expm1(math.log1p(max(networks[i], 0)) + margin) - deal_prices[i],
+                lambda i: (i, discounts[i]),
+                threshold,
+            )
+            changed += surfaced(discounts) != surfaced({i: discounts[i] for i in priced})
+            saved += len(run) - len(priced)
+        return {"margin": margin, "runs_changed": changed, "pricings_saved": saved}
+
+    return {
+        "commit": current_commit(),
+        "items": len(items),
+        "threshold": threshold,
+        "runs": len(runs),
+        "folds": len(ensembles) if len(ensembles) > 1 else None,
+        "gap": {"max": float(gaps.max()), "p99": float(np.percentile(gaps, 99)), "above_margin": int((gaps > BOUND_MARGIN).sum())},
+        "recommended_margin": recommended,
+        "current": check(BOUND_MARGIN),
+        "recommended": check(recommended),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the latency and accuracy of the Ensemble Agent")
+    parser.add_argument("mode", choices=["record", "replay", "cascade", "bounds"])
+    parser.add_argument("items", nargs="?", help="record only: a JSON list of {description, price}, or curated Items")
+    parser.add_argument("--limit", type=int, help="record only: the number of items to use")
+    parser.add_argument("--recordings", default=RECORDINGS)
+    parser.add_argument("--report", default=REPORT)
+    parser.add_argument("--threshold", type=float, help="cascade and bounds: the discount worth surfacing")
+    parser.add_argument("--folds", type=int, default=FOLDS, help="replay, cascade and bounds: folds to cross-validate a trained combiner; 0 to use it as is")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        if not args.items:
+            parser.error("record needs an item set")
+        result = record(load_items(args.items, args.limit), args.recordings)
+    elif args.mode in ("cascade", "bounds"):
+        from agents.deterministic_planning_agent import DeterministicPlanningAgent
+        threshold = args.threshold if args.threshold is not None else DeterministicPlanningAgent.DISCOUNT_THRESHOLD
+        compare = compare_cascade if args.mode == "cascade" else compare_best_first
+        result = compare(args.recordings, threshold, folds=args.folds)
+    else:
+        result = replay(args.recordings, args.folds)
+
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w") as f:
+        json.dump(result, f, indent=2)
+    if args.mode == "cascade":
+        print(json.dumps({"calls_saved": result["calls_saved"], "winners": result["winners"]}, indent=2))
+    elif args.mode == "bounds":
+        print(json.dumps({key: result[key] for key in ("gap", "recommended_margin", "current", "recommended")}, indent=2))
+    else:
+        print(json.dumps({"ensemble": result["ensemble"]["error"], "throughput": result["ensemble"]["throughput"]}, indent=2))
@@ -1,16 +1,18 @@
 import os
 import sys
 import logging
-import json
 from importlib.metadata import metadata
 from typing import List, Optional
 from dotenv import load_dotenv
-import chromadb
-from sklearn.manifold import TSNE
-import numpy as np
+from opentelemetry import trace
 ### Internal classes
 from agents.deterministic_planning_agent import DeterministicPlanningAgent
 from agents.deals import Opportunity
+from agents.seen_deals import SeenDealIndex
+from memory_store import MemoryStore, open_memory_store
+import vectorstore
+from tracing import setup_tracing
+from plot_data import ProjectionCache, PROJECTOR, project, stratified_sample, fetch_in_pages, colors_for
 
 load_dotenv(override=True)
 
@@ -37,6 +39,10 @@ CATEGORIES = [
 
 COLORS = ['red', 'blue', 'brown', 'orange', 'yellow', 'green' , 'purple', 'cyan', "purple", "black", "gray", "pink", "olive"]
 
+CATEGORY_COLORS = dict(zip(CATEGORIES, COLORS))
+
+tracer = trace.get_tracer(__name__)
+
 
 
 def init_logging():
@@ -54,58 +60,51 @@ def init_logging():
 
 
 class DealAgentFramework:
-    DB = os.getenv("PRODUCTION_DB", "products_vectorstore")
+    DB = vectorstore.DB
     MEMORY_FILENAME = "memory.json"
+    MEMORY_DB = os.getenv("MEMORY_DB", "memory.db")
+    ### "sqlite" (indexed database) or "journal" (memory.json snapshot + append-only journal)
+    MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "sqlite")
+    ### Number of most recent opportunities handed back to the UI
+    MEMORY_PAGE_SIZE = 100
+    SEEN_DEALS_FILENAME = "seen_deals.json"
 
     def __init__(self):
         init_logging()
-        client = chromadb.PersistentClient(self.DB)
-        self.memory: List[Opportunity] = self.read_memory()
-        self.collection = client.get_or_create_collection("products")
+        setup_tracing()
+        self.memory: MemoryStore = self.read_memory()
+        self.seen = SeenDealIndex(self.SEEN_DEALS_FILENAME)
+        if self.seen.empty:
+            self.seen.update(opp.deal.url for opp in self.memory)
+        self.collection = vectorstore.get_collection(path=self.DB)
         self.planner = None # lazy initialization
 
     def init_agent_as_needed(self):
         if not self.planner:
             self.log("Initializing Agent Framework...")
-            self.planner = DeterministicPlanningAgent(self.collection)
+            self.planner = DeterministicPlanningAgent(self.collection, seen=self.seen)
             self.log("Agent Framework is ready!")
 
-    def read_memory(self) -> List[Opportunity]:
+    @classmethod
+    def read_memory(cls) -> MemoryStore:
         """
-        Read the memory.json file and convert it into Opportunity pydantic model
-        :return: A list of Opportunity models, or an empty list if no memory file is found.
+        Open the memory store for the configured backend, recovering its state
+        :return: the store of Opportunity models surfaced so far
         """
+        return open_memory_store(cls.MEMORY_BACKEND, cls.MEMORY_DB, cls.MEMORY_FILENAME)
 
-        if os.path.exists(self.MEMORY_FILENAME):
-            with open(self.MEMORY_FILENAME, "r") as f:
-                data: List[dict] = json.load(f)
-                result = [Opportunity(**opp) for opp in data]
-            return result
-        return []
-
-    def write_memory(self) -> None:
+    def write_memory(self, opportunity: Opportunity) -> None:
         """
-        Write opportunities into the memory.json file
+        Append a newly surfaced opportunity to the memory store
         """
-        if self.memory:
-            data: List[dict] = [opp.model_dump() for opp in self.memory]
-            with open(self.MEMORY_FILENAME, "w") as f:
-                json.dump(data, f, indent=2)
+        self.memory.append(opportunity)
 
     @classmethod
     def reset_memory(cls) -> None:
         """
-        Reset data in the memory.json file back to the default state
+        Reset data in the memory store back to the default state
         """
-        data = []
-
-        if os.path.exists(cls.MEMORY_FILENAME):
-            with open(cls.MEMORY_FILENAME, "r") as f:
-                data = json.load(f)
-        truncated = data[:2]
-
-        with open(cls.MEMORY_FILENAME, "w") as f:
-            json.dump(truncated, f, indent=2)
+        cls.read_memory().reset(keep=2)
 
     def log(self, message: str):
         text = BG_BLUE + WHITE + "[Agent Framework] " + message + RESET
@@ -118,39 +117,55 @@ class DealAgentFramework:
         Process:
         1. Init the planner agent
         2. Fetch result (Opportunity pydantic model -- single Opportunity model with the best deal picked out)
-        3. If result is fetched successfully, append it to the memory and write it into memory.json
-        4. Return the Opportunity models
+        3. If result is fetched successfully, append it to the memory store
+        4. Return the most recent Opportunity models
 
         :return: A list of Opportunity models
         """
-        self.log("Deal Agent Framework is initializing Planning Agent...")
-        if not self.planner:
-            self.init_agent_as_needed()
+        with tracer.start_as_current_span("framework.run") as span:
+            self.log("Deal Agent Framework is initializing Planning Agent...")
+            if not self.planner:
+                self.init_agent_as_needed()
 
-        result: Opportunity = self.planner.plan(memory=self.memory)
-        self.log(f"Planning Agent has completed and returned {result}")
-        if result:
-            self.memory.append(result)
-            self.write_memory()
+            result: Opportunity = self.planner.plan(memory=self.memory)
+            self.log(f"Planning Agent has completed and returned {result}")
+            span.set_attribute("deal.surfaced", bool(result))
+            if result:
+                span.set_attribute("deal.url", result.deal.url)
+                self.write_memory(result)
+                self.seen.add(result.deal.url)
+            self.seen.save()
 
-        return self.memory
+        return self.memory.recent(self.MEMORY_PAGE_SIZE)
 
 
     @classmethod
-    def get_plot_data(cls, max_datapoints=2000):
-        client = chromadb.PersistentClient(path=cls.DB)
-        collection = client.get_or_create_collection("products")
-
-        result = collection.get(
-            include=["embeddings", "documents", "metadatas"], limit=max_datapoints
-        )
-        vectors = np.array(result["embeddings"])
-        documents = result["documents"]
-        categories = [metadata["category"] for metadata in result["metadatas"]]
-        colors = [COLORS[CATEGORIES.index(c)] for c in categories]
-
-        tsne = TSNE(n_components=3, random_state=42, n_jobs=1)
-        reduced_vectors = tsne.fit_transform(vectors)
+    def get_plot_data(cls, max_datapoints=2000, projector=PROJECTOR):
+        """
+        Return the documents, their 3D projection and their colors for the vectorstore plot.
+        Documents are sampled across the whole collection, stratified by category.
+        The projection is cached alongside the vectorstore and only recomputed when the collection changes.
+
+        :param max_datapoints: the maximum number of documents to plot
+        :param projector: "tsne" or "pca" - see plot_data.project
+        """
+        collection = vectorstore.get_collection(path=cls.DB)
+        cache = ProjectionCache(cls.DB)
+
+        signature = cache.signature(collection.count(), max_datapoints, projector, cache.fingerprint(collection))
+
+        with ProjectionCache.lock:
+            cached = cache.load(signature)
+            if cached:
+                return cached
+
+            ids = stratified_sample(collection, max_datapoints)
+            vectors, documents, metadatas = fetch_in_pages(collection, ids)
+            categories = [metadata["category"] for metadata in metadatas]
+            colors = colors_for(categories, CATEGORY_COLORS)
+
+            reduced_vectors = project(vectors, projector)
+            cache.save(signature, documents, reduced_vectors, colors)
 
         return documents, reduced_vectors, colors
 
@@ -0,0 +1,115 @@
+"""
+A learned combiner for the Ensemble Agent's three price estimates.
+
+Train it from the recordings of the ensemble benchmark (see benchmark_ensemble.py):
+    python ensemble_combiner.py benchmarks/recordings.json --kind linear
+
+A regressor is fitted for every subset of the models, so the ensemble can combine whichever
+estimates it actually has - e.g. when it skips the specialist because the others already agree.
+"""
+
+import os
+import json
+import argparse
+import threading
+from itertools import combinations
+from typing import Dict, Sequence, Tuple
+import numpy as np
+import joblib
+from sklearn.linear_model import LinearRegression
+
+COMBINER_PATH = os.getenv("ENSEMBLE_COMBINER", os.path.join("models", "ensemble_combiner.joblib"))
+
+### The models, cheapest first
+MODELS = ("neural_network", "frontier", "specialist")
+
+
+def features(predictions: np.ndarray) -> np.ndarray:
+    """
+    Features of a batch of estimates, shape (items, models): the prices, their logs,
+    and the spread of the log prices, a measure of how much the models disagree
+    """
+    prices = np.maximum(np.asarray(predictions, dtype=float), 0)
+    logs = np.log1p(prices)
+    spread = logs.max(axis=1, keepdims=True) - logs.min(axis=1, keepdims=True)
+    return np.hstack([prices, logs, spread])
+
+
+class EnsembleCombiner:
+    """
+    One regressor per subset of the models, predicting the log price from their estimates
+    """
+
+    lock = threading.Lock()
+    loaded: Dict[str, "EnsembleCombiner"] = {}
+
+    def __init__(self, regressors: Dict[Tuple[str, ...], object], kind: str = "linear"):
+        self.regressors = regressors
+        self.kind = kind
+
+    @classmethod
+    def fit(cls, predictions: Dict[str, Sequence[float]], truths: Sequence[float], kind: str = "linear") -> "EnsembleCombiner":
+        """
+        :param predictions: each model's estimates, for the same items
+        :param truths: the true prices of the items
+        :param kind: "linear", or "gbm" for gradient-boosted trees
+        """
+        target = np.log1p(np.asarray(truths, dtype=float))
+        regressors = {}
+        for size in range(1, len(MODELS) + 1):
+            for subset in combinations(MODELS, size):
+                if kind == "gbm":
+                    from sklearn.ensemble import HistGradientBoostingRegressor
+                    regressor = HistGradientBoostingRegressor(max_iter=200, learning_rate=0.05)
+                elif kind == "linear":
+                    regressor = LinearRegression()
+                else:
+                    raise ValueError(f"Unknown combiner kind: {kind}")
+                matrix = np.column_stack([predictions[name] for name in subset])
+                regressors[subset] = regressor.fit(features(matrix), target)
+        return cls(regressors, kind)
+
+    def predict(self, predictions: Dict[str, Sequence[float]]) -> np.ndarray:
+        """
+        Combine a batch of estimates in one vectorised call
+
+        :param predictions: the estimates of some of the models, for the same items
+        :return: the combined prices
+        """
+        subset = tuple(name for name in MODELS if name in predictions)
+        matrix = np.column_stack([predictions[name] for name in subset])
+        return np.maximum(np.expm1(self.regressors[subset].predict(features(matrix))), 0)
+
+    def save(self, path: str = COMBINER_PATH) -> None:
+        joblib.dump({"kind": self.kind, "regressors": self.regressors}, path)
+
+    @classmethod
+    def load(cls, path: str = COMBINER_PATH):
+        """
+        Return the combiner saved at this path, loading it only once per process;
+        None if no combiner was trained
+        """
+        with cls.lock:
+            if path not in cls.loaded:
+                if not os.path.exists(path):
+                    return None
+                artifact = joblib.load(path)
+                cls.loaded[path] = cls(artifact["regressors"], artifact["kind"])
+            return cls.loaded[path]
+
+
+if __name__ == "__main__":
+    from benchmark_ensemble import RECORDINGS, fit_combiner
+
+    parser = argparse.ArgumentParser(description="Train the ensemble combiner from recorded model responses")
+    parser.add_argument("recordings", nargs="?", default=RECORDINGS)
+    parser.add_argument("--kind", choices=["linear", "gbm"], default="linear")
+    parser.add_argument("--output", default=COMBINER_PATH)
+    args = parser.parse_args()
+
+    with open(args.recordings, "r") as f:
+        recordings = json.load(f)
+    combiner = fit_combiner(recordings, kind=args.kind)
+    combiner.save(args.output)
+    print(f"Trained a {args.kind} combiner on {len(recordings['items']):,} items, saved to {args.output}")
+    print("Its error on these same items is optimistic; python benchmark_ensemble.py replay cross-validates it")
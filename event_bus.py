@@ -0,0 +1,226 @@
+"""
+An in-process broadcast bus for log lines and run results.
+Every subscriber - a UI session, a console tail - gets its own bounded ring buffer and waits on it
+until something arrives, so nothing polls, and a slow subscriber only loses its own oldest events.
+A thread blocks on a Subscription; a coroutine awaits an AsyncSubscription, which holds no thread while it waits.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Iterable, List, NamedTuple, Optional, TextIO, Union
+
+### Events kept per subscriber before the oldest are dropped
+BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "500"))
+
+LOG = "log"
+RESULT = "result"
+
+
+class Event(NamedTuple):
+    topic: str
+    data: Any
+    time: float
+
+
+class Subscription:
+    """
+    One subscriber's events, in a ring buffer of bounded size
+    """
+
+    def __init__(self, bus: "EventBus", topics: Optional[Iterable[str]], size: int):
+        self.bus = bus
+        self.topics = set(topics) if topics else None
+        self.events = deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, event: Event) -> None:
+        with self.condition:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(event)
+            self.condition.notify()
+
+    def get(self, timeout: float = None) -> Optional[Event]:
+        """
+        Wait for the next event
+        :return: the event, or None on timeout or once closed
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.events or self.closed, timeout)
+            return self.events.popleft() if self.events else None
+
+    def drain(self, timeout: float = None) -> List[Event]:
+        """
+        Wait for at least one event, then take everything buffered, so a burst is handled in one go
+        :return: the events, oldest first; empty on timeout or once closed
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.events or self.closed, timeout)
+            events = list(self.events)
+            self.events.clear()
+            return events
+
+    def close(self) -> None:
+        self.bus.unsubscribe(self)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class AsyncSubscription:
+    """
+    One subscriber's events, in a bounded asyncio.Queue of an event loop.
+    Publishers hand each event to the loop with call_soon_threadsafe, so publishing never blocks on the
+    subscriber, and the subscriber awaits its events without a thread of its own
+    """
+
+    def __init__(self, bus: "EventBus", topics: Optional[Iterable[str]], size: int, loop: asyncio.AbstractEventLoop):
+        self.bus = bus
+        self.topics = set(topics) if topics else None
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, event: Optional[Event]) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.deliver, event)
+        except RuntimeError:
+            ### The loop has shut down, so there's no one left to deliver to
+            pass
+
+    def deliver(self, event: Optional[Event]) -> None:
+        ### Runs on the loop; None only wakes the subscriber
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def drain(self, timeout: float = None) -> List[Event]:
+        """
+        Wait for at least one event, then take everything buffered, so a burst is handled in one go
+        :return: the events, oldest first; empty on timeout or once closed
+        """
+        if self.closed:
+            return []
+        try:
+            events = [await asyncio.wait_for(self.queue.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.queue.empty():
+            events.append(self.queue.get_nowait())
+        return [event for event in events if event is not None]
+
+    def close(self) -> None:
+        """
+        Stop receiving events and wake the waiting drain; safe to call from any thread
+        """
+        self.bus.unsubscribe(self)
+        self.closed = True
+        self.put(None)
+
+    def __enter__(self) -> "AsyncSubscription":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class EventBus:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions: List[Union[Subscription, AsyncSubscription]] = []
+
+    def subscribe(self, topics: Iterable[str] = None, size: int = BUFFER_SIZE) -> Subscription:
+        """
+        :param topics: (Optional) the topics to receive; all of them by default
+        :param size: the number of events buffered before the oldest are dropped
+        """
+        subscription = Subscription(self, topics, size)
+        with self.lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def subscribe_async(self, topics: Iterable[str] = None, size: int = BUFFER_SIZE) -> AsyncSubscription:
+        """
+        Subscribe the running event loop; its events are awaited with drain
+        :param topics: (Optional) the topics to receive; all of them by default
+        :param size: the number of events buffered before the oldest are dropped
+        """
+        subscription = AsyncSubscription(self, topics, size, asyncio.get_running_loop())
+        with self.lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Union[Subscription, AsyncSubscription]) -> None:
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def publish(self, topic: str, data: Any) -> None:
+        event = Event(topic, data, time.time())
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if subscription.topics is None or topic in subscription.topics:
+                subscription.put(event)
+
+
+class BusHandler(logging.Handler):
+    """
+    Publishes every formatted log record to the bus
+    """
+
+    def __init__(self, bus: EventBus):
+        super().__init__()
+        self.bus = bus
+
+    def emit(self, record):
+        try:
+            self.bus.publish(LOG, self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+### The process-wide bus
+bus = EventBus()
+
+
+def install_log_handler(target: EventBus = bus) -> None:
+    """
+    Publish the root logger's records to the bus; calling it again does nothing
+    """
+    logger = logging.getLogger()
+    if any(isinstance(h, BusHandler) and h.bus is target for h in logger.handlers):
+        return
+    handler = BusHandler(target)
+    handler.setFormatter(logging.Formatter(
+        "[%(asctime)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S %z",
+    ))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+def tail(subscription: Subscription, stream: TextIO = sys.stdout, timeout: float = 1.0) -> None:
+    """
+    Print a subscription's events as they arrive, until it's closed
+    """
+    while not subscription.closed:
+        for event in subscription.drain(timeout):
+            stream.write(f"[{event.topic}] {event.data}\n")
+        stream.flush()
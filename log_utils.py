@@ -1,3 +1,5 @@
+import re
+
 # Foreground colors
 RED = '\033[31m'
 GREEN = '\033[32m'
@@ -26,8 +28,12 @@ mapper = {
 }
 
 
+REPLACEMENTS = {key: f'<span style="color: {value}">' for key, value in mapper.items()}
+REPLACEMENTS[RESET] = '</span>'
+
+### One pass over each message for every code, longest codes first so a combined code wins over its parts
+PATTERN = re.compile("|".join(re.escape(key) for key in sorted(REPLACEMENTS, key=len, reverse=True)))
+
+
 def reformat(message):
-    for key, value in mapper.items():
-        message = message.replace(key, f'<span style="color: {value}">')
-    message = message.replace(RESET, '</span>')
-    return message
\ No newline at end of file
+    return PATTERN.sub(lambda match: REPLACEMENTS[match.group()], message)
@@ -0,0 +1,427 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional, Set, Tuple, Union
+### Internal classes
+from agents.deals import Deal, Opportunity
+
+try:
+    import fcntl
+except ImportError:
+    ### No advisory file locks on this platform: only a single process should write the journal
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Hold an exclusive advisory lock on the given file, shared by every process using the same memory
+    """
+    with open(path, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def fsync_dir(path: str) -> None:
+    """
+    Make a rename inside this directory durable
+    """
+    if os.name != "posix":
+        return
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SQLiteMemoryStore:
+    """
+    The memory of opportunities surfaced so far, kept in an embedded SQLite database.
+    Opportunities are only ever appended, and lookups by URL or time go through indexes,
+    so the cost of a run doesn't grow with the size of the memory.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS opportunities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            product_description TEXT NOT NULL,
+            price REAL NOT NULL,
+            estimate REAL NOT NULL,
+            discount REAL NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_opportunities_url ON opportunities (url);
+        CREATE INDEX IF NOT EXISTS idx_opportunities_created_at ON opportunities (created_at);
+    """
+
+    COLUMNS = "url, product_description, price, estimate, discount, created_at"
+
+    def __init__(self, path: str, legacy_json: str = None):
+        """
+        Open (or create) the store
+
+        :param path: the SQLite database file
+        :param legacy_json: (Optional) a memory.json file to import the first time the store is created
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        ### WAL lets the UI read while a run is appending
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+
+        if legacy_json and len(self) == 0 and os.path.exists(legacy_json):
+            with open(legacy_json, "r") as f:
+                data: List[dict] = json.load(f)
+            self.extend(Opportunity(**opp) for opp in data)
+
+    @staticmethod
+    def to_row(opportunity: Opportunity, created_at: float) -> tuple:
+        deal = opportunity.deal
+        return deal.url, deal.product_description, deal.price, opportunity.estimate, opportunity.discount, created_at
+
+    @staticmethod
+    def from_row(row: tuple) -> Opportunity:
+        url, product_description, price, estimate, discount = row[:5]
+        deal = Deal(product_description=product_description, price=price, url=url)
+        return Opportunity(deal=deal, estimate=estimate, discount=discount)
+
+    def append(self, opportunity: Opportunity) -> None:
+        """
+        Insert a single newly surfaced opportunity
+        """
+        self.extend([opportunity])
+
+    def extend(self, opportunities: Iterable[Opportunity]) -> None:
+        """
+        Insert opportunities in one transaction, keeping their order
+        """
+        now = time.time()
+        rows = [self.to_row(opp, now) for opp in opportunities]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO opportunities ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM opportunities").fetchone()[0]
+
+    def __iter__(self) -> Iterator[Opportunity]:
+        """
+        Iterate over every opportunity, oldest first
+        """
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {self.COLUMNS} FROM opportunities ORDER BY id").fetchall()
+        return (self.from_row(row) for row in rows)
+
+    def page(self, offset: int = 0, limit: int = 100) -> List[Opportunity]:
+        """
+        Return one page of opportunities, newest first
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM opportunities ORDER BY id DESC LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [self.from_row(row) for row in rows]
+
+    def recent(self, limit: int = 100) -> List[Opportunity]:
+        """
+        Return the most recent opportunities, oldest first - the order the UI table has always used
+        """
+        return self.page(0, limit)[::-1]
+
+    def since(self, timestamp: float) -> List[Opportunity]:
+        """
+        Return the opportunities surfaced at or after the given unix timestamp, oldest first
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM opportunities WHERE created_at >= ? ORDER BY id", (timestamp,)
+            ).fetchall()
+        return [self.from_row(row) for row in rows]
+
+    def known_urls(self, urls: Iterable[str]) -> Set[str]:
+        """
+        Return the subset of the given URLs that have already been surfaced
+        """
+        urls = list(set(urls))
+        known = set()
+        with self.lock:
+            ### Stay well below SQLite's limit on the number of bound parameters
+            for i in range(0, len(urls), 500):
+                chunk = urls[i:i + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT DISTINCT url FROM opportunities WHERE url IN ({placeholders})", chunk
+                ).fetchall()
+                known.update(row[0] for row in rows)
+        return known
+
+    def reset(self, keep: int = 2) -> None:
+        """
+        Drop everything but the first `keep` opportunities
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM opportunities WHERE id NOT IN (SELECT id FROM opportunities ORDER BY id LIMIT ?)", (keep,)
+            )
+
+
+class JournalMemoryStore:
+    """
+    The memory of opportunities surfaced so far, kept as a memory.json snapshot plus an append-only JSONL journal.
+    Each new opportunity is one fsynced line in the journal, so a run only pays for what it adds,
+    and a crash can at worst leave a torn last line, which is skipped on recovery.
+    The journal is periodically compacted into the snapshot in a background thread.
+    Writers in every process serialize on a lock file, and readers pick up other processes' appends from the journal.
+    """
+
+    COMPACT_EVERY = 50
+
+    def __init__(self, snapshot_path: str, journal_path: str = None, compact_every: int = COMPACT_EVERY):
+        """
+        Open the store, recovering its state from the snapshot and the journal
+
+        :param snapshot_path: the memory.json snapshot, in the same format as it has always been
+        :param journal_path: (Optional) the JSONL journal, next to the snapshot by default
+        :param compact_every: the number of journal records that triggers a compaction
+        """
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or os.path.splitext(snapshot_path)[0] + ".jsonl"
+        self.lock_path = snapshot_path + ".lock"
+        self.compact_every = compact_every
+        self.lock = threading.RLock()
+        self.compaction: Optional[threading.Thread] = None
+
+        ### (seq, created_at, opportunity), in order
+        self.records: List[Tuple[int, float, Opportunity]] = []
+        self.urls: Set[str] = set()
+        self.loaded = False
+        self.journal_inode = None
+        self.journal_offset = 0
+        self.journal_count = 0
+        with self.lock:
+            self.refresh()
+
+    @property
+    def last_seq(self) -> int:
+        return self.records[-1][0] if self.records else 0
+
+    def add_record(self, seq: int, created_at: float, opportunity: Opportunity) -> None:
+        self.records.append((seq, created_at, opportunity))
+        self.urls.add(opportunity.deal.url)
+
+    def load_snapshot(self) -> None:
+        """
+        Replace the in-memory state with the snapshot.
+        Entries written before the journal existed have no seq or created_at, so they get them from their position
+        """
+        self.records = []
+        self.urls = set()
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r") as f:
+                data: List[dict] = json.load(f)
+            for i, entry in enumerate(data):
+                self.add_record(entry.get("seq", i + 1), entry.get("created_at", 0.0), Opportunity(**entry))
+        self.loaded = True
+
+    def refresh(self) -> None:
+        """
+        Bring the in-memory state up to date with the journal, reading only what was appended since the last call.
+        If the journal was replaced by a compaction, start again from the new snapshot
+        """
+        try:
+            stat = os.stat(self.journal_path)
+        except FileNotFoundError:
+            stat = None
+        inode = stat.st_ino if stat else None
+
+        if not self.loaded or inode != self.journal_inode or (stat and stat.st_size < self.journal_offset):
+            self.load_snapshot()
+            self.journal_inode = inode
+            self.journal_offset = 0
+            self.journal_count = 0
+        if stat is None:
+            return
+
+        with open(self.journal_path, "rb") as f:
+            f.seek(self.journal_offset)
+            data = f.read()
+
+        ### Only consume complete lines; a line still being written is picked up next time
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                ### Torn write from a crash
+                continue
+            self.journal_count += 1
+            ### Records already folded into the snapshot by an interrupted compaction are skipped
+            if entry["seq"] > self.last_seq:
+                self.add_record(entry["seq"], entry["created_at"], Opportunity(**entry["opportunity"]))
+        self.journal_offset += end
+
+    def append(self, opportunity: Opportunity) -> None:
+        """
+        Durably append a single newly surfaced opportunity
+        """
+        self.extend([opportunity])
+
+    def extend(self, opportunities: Iterable[Opportunity]) -> None:
+        """
+        Durably append opportunities to the journal, keeping their order
+        """
+        opportunities = list(opportunities)
+        if not opportunities:
+            return
+
+        with self.lock, file_lock(self.lock_path):
+            self.refresh()
+            now = time.time()
+            lines = [
+                json.dumps({"seq": self.last_seq + i + 1, "created_at": now, "opportunity": opp.model_dump()})
+                for i, opp in enumerate(opportunities)
+            ]
+            with open(self.journal_path, "a+b") as f:
+                data = "\n".join(lines).encode() + b"\n"
+                ### Never extend a torn line left behind by a crash
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        data = b"\n" + data
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.refresh()
+            needs_compaction = self.journal_count >= self.compact_every
+
+        if needs_compaction:
+            self.compact_in_background()
+
+    def compact(self) -> None:
+        """
+        Fold the journal into a new snapshot, then start an empty journal.
+        Both files are replaced atomically, so a crash at any point leaves a recoverable state
+        """
+        with self.lock, file_lock(self.lock_path):
+            self.refresh()
+            self.write_snapshot()
+
+    def write_snapshot(self) -> None:
+        """
+        Write every record to the snapshot and empty the journal; the caller must hold both locks
+        """
+        data = [
+            {**opp.model_dump(), "seq": seq, "created_at": created_at} for seq, created_at, opp in self.records
+        ]
+        self.replace_file(self.snapshot_path, json.dumps(data, indent=2).encode())
+        self.replace_file(self.journal_path, b"")
+        self.journal_inode = os.stat(self.journal_path).st_ino
+        self.journal_offset = 0
+        self.journal_count = 0
+
+    def compact_in_background(self) -> None:
+        """
+        Start a compaction in a daemon thread, unless one is already running
+        """
+        with self.lock:
+            if self.compaction and self.compaction.is_alive():
+                return
+            self.compaction = threading.Thread(target=self.compact, daemon=True)
+            self.compaction.start()
+
+    @staticmethod
+    def replace_file(path: str, content: bytes) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        fsync_dir(os.path.dirname(path))
+
+    def __len__(self) -> int:
+        with self.lock:
+            self.refresh()
+            return len(self.records)
+
+    def __iter__(self) -> Iterator[Opportunity]:
+        """
+        Iterate over every opportunity, oldest first
+        """
+        with self.lock:
+            self.refresh()
+            records = list(self.records)
+        return (opp for _, _, opp in records)
+
+    def page(self, offset: int = 0, limit: int = 100) -> List[Opportunity]:
+        """
+        Return one page of opportunities, newest first
+        """
+        with self.lock:
+            self.refresh()
+            end = len(self.records) - offset
+            return [opp for _, _, opp in reversed(self.records[max(0, end - limit):max(0, end)])]
+
+    def recent(self, limit: int = 100) -> List[Opportunity]:
+        """
+        Return the most recent opportunities, oldest first - the order the UI table has always used
+        """
+        return self.page(0, limit)[::-1]
+
+    def since(self, timestamp: float) -> List[Opportunity]:
+        """
+        Return the opportunities surfaced at or after the given unix timestamp, oldest first
+        """
+        with self.lock:
+            self.refresh()
+            return [opp for _, created_at, opp in self.records if created_at >= timestamp]
+
+    def known_urls(self, urls: Iterable[str]) -> Set[str]:
+        """
+        Return the subset of the given URLs that have already been surfaced
+        """
+        with self.lock:
+            self.refresh()
+            return {url for url in urls if url in self.urls}
+
+    def reset(self, keep: int = 2) -> None:
+        """
+        Drop everything but the first `keep` opportunities
+        """
+        with self.lock, file_lock(self.lock_path):
+            self.refresh()
+            self.records = self.records[:keep]
+            self.urls = {opp.deal.url for _, _, opp in self.records}
+            self.write_snapshot()
+
+
+MemoryStore = Union[SQLiteMemoryStore, JournalMemoryStore]
+
+
+def open_memory_store(backend: str, db_path: str, snapshot_path: str) -> MemoryStore:
+    """
+    Open the memory store for the configured backend
+
+    :param backend: "sqlite" for the indexed database, or "journal" for memory.json with an append-only journal
+    :param db_path: the SQLite database file, used by the "sqlite" backend
+    :param snapshot_path: the memory.json file - the snapshot of the "journal" backend, and imported once by "sqlite"
+    """
+    if backend == "sqlite":
+        return SQLiteMemoryStore(db_path, legacy_json=snapshot_path)
+    elif backend == "journal":
+        return JournalMemoryStore(snapshot_path)
+    else:
+        raise ValueError(f"Unknown memory backend: {backend}")
@@ -0,0 +1,253 @@
+"""
+One shared OpenAI client for all agents, with the calls scheduled so that parallel agents stay within
+the account's rate limits:
+- token buckets for requests per minute and tokens per minute
+- retries with jittered exponential backoff on 429, 5xx and connection errors
+- a cap on the concurrent calls of each agent
+
+Agents use client_for(name) in place of OpenAI(); it has the same chat.completions.create and parse methods.
+The client honours OPENAI_BASE_URL, so everything can be pointed at a local fake OpenAI-compatible server.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from typing import Dict, List
+import openai
+from openai import OpenAI
+from opentelemetry import trace
+
+RPM = int(os.getenv("OPENAI_RPM", "500"))
+TPM = int(os.getenv("OPENAI_TPM", "200000"))
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+### Backoff before retry n is uniform in [0, min(BACKOFF_CAP, BACKOFF_BASE * 2^n)] seconds
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+### Concurrent calls allowed per agent; any other agent gets DEFAULT_CONCURRENCY
+CONCURRENCY = {
+    "Scanner Agent": 1,
+    "Frontier Agent": int(os.getenv("FRONTIER_CONCURRENCY", "5")),
+    "Messaging Agent": 1,
+    "Autonomous Planning Agent": 1,
+}
+DEFAULT_CONCURRENCY = 4
+
+### Tokens reserved for a reply, on top of the prompt, until the actual usage is known
+COMPLETION_ALLOWANCE = 500
+
+lock = threading.Lock()
+scheduler = None
+
+tracer = trace.get_tracer(__name__)
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens, refilled continuously at rate per minute; acquire blocks until enough are available
+    """
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float = 1, timeout: float = None) -> bool:
+        """
+        Take tokens, waiting up to timeout seconds for them (as long as it takes by default)
+        :return: whether they were taken
+        """
+        ### A request larger than the bucket waits for a full bucket rather than forever
+        amount = min(amount, self.capacity)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.condition:
+            while True:
+                self.refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return True
+                wait = (amount - self.tokens) / self.rate
+                if deadline is not None:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        return False
+                    wait = min(wait, left)
+                self.condition.wait(wait)
+
+    def adjust(self, amount: float) -> None:
+        """
+        Give back (or take, if negative) tokens once the actual cost of a call is known
+        """
+        with self.condition:
+            self.refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+            self.condition.notify_all()
+
+
+def estimate_tokens(messages: List) -> int:
+    """
+    A rough count of the tokens of a request: about 4 characters per token, plus room for the reply
+    """
+    chars = sum(len(str(m.get("content") or "")) if isinstance(m, dict) else len(str(getattr(m, "content", "") or "")) for m in messages)
+    return chars // 4 + COMPLETION_ALLOWANCE
+
+
+def retryable(error: Exception) -> bool:
+    ### A timeout is a subclass of APIConnectionError, but it means the caller's time is up, not a transient failure
+    if isinstance(error, openai.APITimeoutError):
+        return False
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def rejected(error: Exception) -> bool:
+    """
+    Whether a failed request never reached the model, so the tokens reserved for it weren't spent
+    """
+    if isinstance(error, openai.APITimeoutError):
+        return False
+    return isinstance(error, (openai.RateLimitError, openai.APIConnectionError))
+
+
+def retry_after(error: Exception):
+    """
+    The server's requested wait in seconds, if it sent one
+    """
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class Scheduler:
+    """
+    Runs the OpenAI calls of every agent through the shared limits
+    """
+
+    def __init__(self, client: OpenAI = None, rpm: int = RPM, tpm: int = TPM, max_retries: int = MAX_RETRIES):
+        """
+        :param client: (Optional) the OpenAI client; one without its own retries by default
+        :param rpm: requests per minute
+        :param tpm: tokens per minute
+        :param max_retries: retries of a call that failed with a retryable error
+        """
+        self.client = client or OpenAI(max_retries=0)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.semaphores: Dict[str, threading.Semaphore] = {}
+        self.lock = threading.Lock()
+
+    def semaphore(self, agent: str) -> threading.Semaphore:
+        with self.lock:
+            if agent not in self.semaphores:
+                self.semaphores[agent] = threading.Semaphore(CONCURRENCY.get(agent, DEFAULT_CONCURRENCY))
+            return self.semaphores[agent]
+
+    def call(self, agent: str, method: str, **kwargs):
+        """
+        Call chat.completions.<method> for an agent, within its concurrency cap and the rate limits,
+        retrying transient failures. A timeout passed in kwargs bounds the whole call, retries included
+
+        :param agent: the name of the calling agent
+        :param method: "create" or "parse"
+        """
+        function = getattr(self.client.chat.completions, method)
+        estimated = estimate_tokens(kwargs.get("messages", []))
+        timeout = kwargs.get("timeout")
+        deadline = time.monotonic() + timeout if isinstance(timeout, (int, float)) else None
+
+        def remaining():
+            return max(deadline - time.monotonic(), 0) if deadline is not None else None
+
+        attributes = {"agent": agent, "model": kwargs.get("model", ""), "tokens.estimated": estimated}
+        with tracer.start_as_current_span("openai.call", attributes=attributes) as span:
+            semaphore = self.semaphore(agent)
+            if not semaphore.acquire(timeout=remaining()):
+                raise TimeoutError(f"[{agent}] No time left for the OpenAI call")
+            try:
+                for attempt in range(self.max_retries + 1):
+                    ### Waiting on the rate limits counts against the call's timeout too
+                    if not self.requests.acquire(1, remaining()):
+                        raise TimeoutError(f"[{agent}] No time left for the OpenAI call")
+                    if not self.tokens.acquire(estimated, remaining()):
+                        self.requests.adjust(1)
+                        raise TimeoutError(f"[{agent}] No time left for the OpenAI call")
+                    if deadline is not None:
+                        kwargs["timeout"] = remaining()
+                    try:
+                        response = function(**kwargs)
+                    except Exception as error:
+                        if rejected(error):
+                            self.tokens.adjust(estimated)
+                        if not retryable(error) or attempt == self.max_retries:
+                            raise
+                        delay = retry_after(error) or random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                        if deadline is not None and time.monotonic() + delay >= deadline:
+                            raise
+                        span.add_event("retry", {"error": type(error).__name__, "delay": delay})
+                        logging.warning(f"[{agent}] OpenAI call failed ({type(error).__name__}), retrying in {delay:.1f}s")
+                        time.sleep(delay)
+                        continue
+                    span.set_attribute("retries", attempt)
+                    usage = getattr(response, "usage", None)
+                    if usage is not None and usage.total_tokens is not None:
+                        span.set_attribute("tokens.prompt", usage.prompt_tokens)
+                        span.set_attribute("tokens.completion", usage.completion_tokens)
+                        self.tokens.adjust(estimated - usage.total_tokens)
+                    return response
+            finally:
+                semaphore.release()
+
+
+class Completions:
+    def __init__(self, scheduler: Scheduler, agent: str):
+        self.scheduler = scheduler
+        self.agent = agent
+
+    def create(self, **kwargs):
+        return self.scheduler.call(self.agent, "create", **kwargs)
+
+    def parse(self, **kwargs):
+        return self.scheduler.call(self.agent, "parse", **kwargs)
+
+
+class Chat:
+    def __init__(self, scheduler: Scheduler, agent: str):
+        self.completions = Completions(scheduler, agent)
+
+
+class AgentClient:
+    """
+    What an agent sees as its OpenAI client: client.chat.completions.create / parse, scheduled for that agent
+    """
+
+    def __init__(self, scheduler: Scheduler, agent: str):
+        self.chat = Chat(scheduler, agent)
+
+
+def get_scheduler() -> Scheduler:
+    """
+    Return the process-wide scheduler, creating it on first use
+    """
+    global scheduler
+    with lock:
+        if scheduler is None:
+            scheduler = Scheduler()
+        return scheduler
+
+
+def client_for(agent: str) -> AgentClient:
+    return AgentClient(get_scheduler(), agent)
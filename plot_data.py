@@ -0,0 +1,183 @@
+import os
+import random
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+PROJECTION_FILENAME = "plot_projection.npz"
+
+### Projector used for the 3D plot: "tsne" (multi-threaded) or "pca" (fast, linear)
+PROJECTOR = os.getenv("PLOT_PROJECTOR", "tsne")
+
+### Rows requested from Chroma per round trip while streaming the collection
+PAGE_SIZE = 5000
+
+### Rows whose ids and documents go into the cache signature, a cheap check on the collection's content
+PROBE_SIZE = 100
+
+
+def stratified_sample(collection, max_datapoints: int, page_size: int = PAGE_SIZE, seed: int = 42) -> List[str]:
+    """
+    Pick up to max_datapoints ids from the whole collection, stratified by category.
+    The collection is streamed in pages of metadata only, keeping a reservoir per category,
+    so memory stays bounded by the sample size rather than the size of the collection.
+
+    :param collection: the Chroma collection to sample from
+    :param max_datapoints: the total number of ids to return
+    :param page_size: the number of rows fetched per page
+    :param seed: random seed, so the same collection always gives the same sample
+    :return: the sampled ids, with each category represented in proportion to its size
+    """
+    rng = random.Random(seed)
+    reservoirs: Dict[str, List[str]] = {}
+    seen: Dict[str, int] = {}
+
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        for doc_id, metadata in zip(page["ids"], page["metadatas"]):
+            category = metadata.get("category", "")
+            reservoir = reservoirs.setdefault(category, [])
+            seen[category] = seen.get(category, 0) + 1
+            ### Reservoir sampling - each category keeps a uniform sample of up to max_datapoints ids
+            if len(reservoir) < max_datapoints:
+                reservoir.append(doc_id)
+            else:
+                j = rng.randrange(seen[category])
+                if j < max_datapoints:
+                    reservoir[j] = doc_id
+        offset += len(page["ids"])
+
+    total = sum(seen.values())
+    if total <= max_datapoints:
+        return [doc_id for reservoir in reservoirs.values() for doc_id in reservoir]
+
+    ids = []
+    for category, reservoir in reservoirs.items():
+        ### Proportional quota, but never drop a category entirely
+        quota = max(1, round(max_datapoints * seen[category] / total))
+        rng.shuffle(reservoir)
+        ids.extend(reservoir[:quota])
+    return ids[:max_datapoints]
+
+
+def fetch_in_pages(collection, ids: List[str], page_size: int = PAGE_SIZE) -> Tuple[np.ndarray, List[str], List[dict]]:
+    """
+    Fetch the embeddings, documents and metadatas of the given ids, a page at a time
+    """
+    vectors, documents, metadatas = [], [], []
+    for i in range(0, len(ids), page_size):
+        result = collection.get(ids=ids[i:i + page_size], include=["embeddings", "documents", "metadatas"])
+        vectors.append(np.asarray(result["embeddings"], dtype=np.float32))
+        documents.extend(result["documents"])
+        metadatas.extend(result["metadatas"])
+    return np.concatenate(vectors) if vectors else np.empty((0, 0), dtype=np.float32), documents, metadatas
+
+
+def colors_for(categories: List[str], category_colors: Dict[str, str], default: str = "gray") -> List[str]:
+    """
+    Map each category to its plot color, looking up every distinct category only once
+    """
+    uniques, inverse = np.unique(np.asarray(categories, dtype=str), return_inverse=True)
+    palette = np.array([category_colors.get(c, default) for c in uniques])
+    return palette[inverse].tolist()
+
+
+def compact(vectors: np.ndarray, decimals: int = 3) -> np.ndarray:
+    """
+    Shrink the projected points before they're sent to the browser: float32 with limited precision
+    serializes to a much smaller typed array, which keeps the WebGL scatter responsive with many points
+    """
+    return np.round(np.asarray(vectors, dtype=np.float32), decimals)
+
+
+def project(vectors: np.ndarray, projector: str = PROJECTOR) -> np.ndarray:
+    """
+    Reduce the embedding vectors into 3 dimensions for the scatter plot
+
+    :param vectors: 2D array of embeddings, one row per document
+    :param projector: "tsne" for a t-SNE projection using every core, or "pca" for a much faster linear one
+    :return: array of shape (len(vectors), 3)
+    """
+    if projector == "tsne":
+        from sklearn.manifold import TSNE
+        return TSNE(n_components=3, random_state=42, n_jobs=-1).fit_transform(vectors)
+    elif projector == "pca":
+        from sklearn.decomposition import PCA
+        return PCA(n_components=3, random_state=42).fit_transform(vectors)
+    else:
+        raise ValueError(f"Unknown projector: {projector}")
+
+
+class ProjectionCache:
+    """
+    Persist the 3D projection of the vectorstore next to the store itself,
+    so it's computed once per version of the collection instead of on every app start
+    """
+
+    ### Shared across instances so concurrent UI sessions wait for one projection instead of each running their own
+    lock = threading.Lock()
+
+    def __init__(self, db_path: str):
+        self.path = os.path.join(db_path, PROJECTION_FILENAME)
+
+    @staticmethod
+    def fingerprint(collection, probe: int = PROBE_SIZE) -> str:
+        """
+        A cheap hash of the collection's content: the ids and documents of its first rows.
+        A rebuild with the same count changes it; an upsert further in doesn't, which is why ingestion invalidates the cache
+        """
+        rows = collection.get(include=["documents"], limit=probe)
+        digest = hashlib.sha1()
+        for doc_id, document in zip(rows["ids"], rows["documents"]):
+            digest.update(f"{doc_id}\n{document}\n".encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def signature(count: int, max_datapoints: int, projector: str, fingerprint: str = "") -> str:
+        """
+        Fingerprint a version of the collection: its size and content fingerprint, along with how it's sampled and projected
+        """
+        return hashlib.sha1(f"{count}:{fingerprint}:{max_datapoints}:{projector}".encode()).hexdigest()
+
+    def load(self, signature: str) -> Optional[Tuple[List[str], np.ndarray, List[str]]]:
+        """
+        Return the cached (documents, vectors, colors) if they were computed for this signature, otherwise None
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["signature"]) != signature:
+                    return None
+                return data["documents"].tolist(), data["vectors"], data["colors"].tolist()
+        except (OSError, KeyError, ValueError):
+            ### A corrupt or outdated cache file is simply recomputed
+            return None
+
+    def invalidate(self) -> None:
+        """
+        Drop the cached projection, e.g. after new items were ingested into the collection
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def save(self, signature: str, documents: List[str], vectors: np.ndarray, colors: List[str]) -> None:
+        """
+        Write the projection atomically, so a reader never sees a half-written file
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                signature=np.array(signature),
+                documents=np.array(documents, dtype=str),
+                vectors=np.asarray(vectors, dtype=np.float32),
+                colors=np.array(colors, dtype=str),
+            )
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,182 @@
+"""
+Resumable ingestion of curated Items into the products vectorstore.
+
+Run from the repository root:
+    python -m prototypes.build_vectorstore train.parquet --db products_vectorstore --workers 4
+
+Items are streamed in chunks from an Arrow or Parquet file (a pickle of Items is accepted too, but is loaded whole),
+encoded with MiniLM in large batches across CPU worker processes, and upserted into Chroma in bulk. A checkpoint is written after every chunk, so an interrupted
+build resumes where it stopped, and ids are stable (doc_<n>), so replaying a chunk is harmless.
+"""
+
+import os
+import json
+import pickle
+import argparse
+from itertools import islice
+from typing import Iterable, Iterator, List
+import chromadb
+from tqdm import tqdm
+### Internal classes
+from plot_data import ProjectionCache
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+COLLECTION = "products"
+CHUNK_SIZE = 10_000
+BATCH_SIZE = 256
+CHECKPOINT_FILENAME = "ingest_checkpoint.json"
+### A pickle is loaded whole, so larger ones are refused in favour of converting them to Arrow/Parquet
+MAX_PICKLE_MB = int(os.getenv("MAX_PICKLE_MB", "512"))
+
+
+def description(item) -> str:
+    """
+    The text stored and embedded for an Item: its prompt without the question and the price
+    """
+    text = item.prompt.replace("How much does this cost to the nearest dollar?\n\n", "")
+    return text.split("\n\nPrice is $")[0]
+
+
+def iter_items(path: str, max_pickle_mb: int = MAX_PICKLE_MB, batch_size: int = CHUNK_SIZE) -> Iterator:
+    """
+    Stream Items from a file written by items.save_items: a .parquet file is decoded batch_size rows at a time,
+    and an .arrow file is memory-mapped, so memory stays bounded either way.
+    A pickle of a list of Items, as produced by the curation notebooks, is read into memory in full,
+    so one larger than max_pickle_mb is refused; convert it once with
+        python -c "import pickle; from prototypes.items import save_items; save_items(pickle.load(open('train.pkl', 'rb')), 'train.parquet')"
+    """
+    if path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        from prototypes.items import ItemTable
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield from ItemTable(pa.Table.from_batches([batch]))
+    elif path.endswith(".arrow"):
+        from prototypes.items import ItemTable
+        yield from ItemTable.load(path)
+    else:
+        size_mb = os.path.getsize(path) / 2 ** 20
+        if size_mb > max_pickle_mb:
+            raise ValueError(
+                f"{path} is {size_mb:,.0f} MB, and a pickle is loaded whole; "
+                f"convert it to .parquet with prototypes.items.save_items, or raise --max-pickle-mb"
+            )
+        with open(path, "rb") as f:
+            yield from pickle.load(f)
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Checkpoint:
+    """
+    The number of Items of a given source already upserted, stored next to the vectorstore
+    """
+
+    def __init__(self, db_path: str, source: str):
+        self.path = os.path.join(db_path, CHECKPOINT_FILENAME)
+        self.source = os.path.abspath(source)
+        self.done = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("source") == self.source:
+                self.done = data["done"]
+
+    def save(self, done: int) -> None:
+        self.done = done
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"source": self.source, "done": done}, f)
+        os.replace(tmp_path, self.path)
+
+
+class Encoder:
+    """
+    MiniLM sentence encoder, spread over a pool of CPU processes when workers > 1
+    """
+
+    def __init__(self, workers: int = 1, batch_size: int = BATCH_SIZE):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+        self.batch_size = batch_size
+        self.pool = self.model.start_multi_process_pool(["cpu"] * workers) if workers > 1 else None
+
+    def encode(self, documents: List[str]):
+        return self.model.encode(documents, batch_size=self.batch_size, pool=self.pool)
+
+    def close(self) -> None:
+        if self.pool:
+            self.model.stop_multi_process_pool(self.pool)
+
+
+def ingest(
+        items: Iterable,
+        db_path: str,
+        source: str,
+        workers: int = 1,
+        chunk_size: int = CHUNK_SIZE,
+        batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Embed and upsert Items into the products collection, resuming from the last checkpoint
+
+    :param items: the Items to ingest, in a stable order
+    :param db_path: the vectorstore directory
+    :param source: identifies the input for the checkpoint, usually its path
+    :param workers: the number of CPU processes used for encoding
+    :param chunk_size: the number of Items encoded, upserted and checkpointed together
+    :param batch_size: the encoder batch size
+    :return: the total number of Items in the collection from this source
+    """
+    client = chromadb.PersistentClient(path=db_path)
+    collection = client.get_or_create_collection(COLLECTION)
+    checkpoint = Checkpoint(db_path, source)
+    ### Chroma caps the number of records per call
+    max_batch = client.get_max_batch_size()
+
+    encoder = Encoder(workers, batch_size)
+    done = checkpoint.done
+    try:
+        for chunk in tqdm(chunked(islice(items, done, None), chunk_size), desc="Chunks"):
+            documents = [description(item) for item in chunk]
+            vectors = encoder.encode(documents)
+            metadatas = [{"category": item.category, "price": item.price} for item in chunk]
+            ids = [f"doc_{j}" for j in range(done, done + len(chunk))]
+
+            for i in range(0, len(chunk), max_batch):
+                collection.upsert(
+                    ids=ids[i:i + max_batch],
+                    documents=documents[i:i + max_batch],
+                    embeddings=vectors[i:i + max_batch],
+                    metadatas=metadatas[i:i + max_batch],
+                )
+            done += len(chunk)
+            checkpoint.save(done)
+            ### The plot's cached projection is of the collection as it was
+            ProjectionCache(db_path).invalidate()
+    finally:
+        encoder.close()
+
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or grow the products vectorstore from curated Items")
+    parser.add_argument(
+        "source",
+        help=".arrow or .parquet file of curated Items (streamed), or a pickle of a list of Items (loaded whole)",
+    )
+    parser.add_argument("--db", default=os.getenv("PRODUCTION_DB", "products_vectorstore"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--max-pickle-mb", type=int, default=MAX_PICKLE_MB, help="largest pickle source accepted")
+    args = parser.parse_args()
+
+    total = ingest(iter_items(args.source, args.max_pickle_mb, args.chunk_size), args.db, args.source, args.workers, args.chunk_size, args.batch_size)
+    print(f"Ingested {total:,} items into {args.db}")
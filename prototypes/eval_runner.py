@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+import marshal
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Sequence
+from tqdm import tqdm
+
+RESULTS_DIR = "eval_results"
+
+### Stands for "not predicted yet", since None is a prediction like any other and is cached as one
+MISSING = object()
+
+
+def item_key(datapoint) -> str:
+    """
+    A stable hash of a datapoint: an Item's title, price and prompt, or the contents of a dict
+    """
+    if isinstance(datapoint, dict):
+        text = json.dumps(datapoint, sort_keys=True, default=str)
+    else:
+        text = f"{datapoint.title}\n{datapoint.price}\n{getattr(datapoint, 'prompt', '')}"
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def predictor_version(predictor: Callable, version: str = None) -> str:
+    """
+    Identify a predictor's implementation in the result cache: the version given by the caller, or else a hash
+    of the predictor's code, so two lambdas or an edited function never share results.
+    A predictor whose code is unchanged but whose model was retrained needs a new version
+    """
+    if version is not None:
+        return str(version)
+    code = getattr(predictor, "__code__", None) or getattr(getattr(type(predictor), "__call__", None), "__code__", None)
+    if code is None:
+        raise ValueError(f"Can't identify {predictor!r} for the result cache; pass a version")
+    return hashlib.sha1(marshal.dumps(code)).hexdigest()[:12]
+
+
+def call_predictor(predictor: Callable, args: tuple):
+    """
+    Module-level, so it can be sent to a worker process
+    """
+    return predictor(*args)
+
+
+class ResultCache:
+    """
+    Predictions persisted one JSON line per datapoint, keyed by item hash, in a file per predictor and version.
+    A crashed or interrupted evaluation loses nothing it already paid for, and re-running resumes from there
+    """
+
+    def __init__(self, name: str, directory: str = RESULTS_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        self.lock = threading.Lock()
+        self.results: Dict[str, Any] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        ### Torn last line of an interrupted run
+                        continue
+                    self.results[entry["key"]] = entry["value"]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.results
+
+    def __getitem__(self, key: str):
+        return self.results[key]
+
+    def put(self, key: str, value) -> None:
+        with self.lock:
+            self.results[key] = value
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"key": key, "value": value}) + "\n")
+
+
+class EvaluationRunner:
+    """
+    Run a predictor over many datapoints concurrently, with every result cached on disk as it arrives.
+    Use threads for I/O-bound predictors (API and remote model calls) and processes for CPU-bound ones
+    """
+
+    def __init__(self, name: str, workers: int = 5, executor: str = "thread", cache_dir: str = None, version: str = None):
+        """
+        :param name: names the predictor in the progress bar and the result cache
+        :param workers: the number of concurrent calls
+        :param executor: "thread" or "process"; a process predictor must be picklable (e.g. a module-level function)
+        :param cache_dir: (Optional) where results are persisted, e.g. RESULTS_DIR; no caching by default
+        :param version: identifies the predictor's implementation in the cache - see predictor_version;
+            required when caching
+        """
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor: {executor}")
+        if cache_dir and version is None:
+            raise ValueError("A cached evaluation needs the predictor's version")
+        self.name = name
+        self.workers = workers
+        self.executor = executor
+        self.cache = ResultCache(f"{name}-{version}", cache_dir) if cache_dir else None
+
+    def run(self, predictor: Callable, args: Sequence[tuple], keys: Sequence[str]) -> List:
+        """
+        Call the predictor with each tuple of arguments, skipping those whose key is already cached
+
+        :return: the predictions, in the order of args
+        """
+        results = [None] * len(args)
+        pending = []
+        for i, key in enumerate(keys):
+            if self.cache is not None and key in self.cache:
+                results[i] = self.cache[key]
+            else:
+                pending.append(i)
+
+        if pending:
+            pool = ThreadPoolExecutor if self.executor == "thread" else ProcessPoolExecutor
+            with pool(max_workers=self.workers) as ex:
+                futures = {ex.submit(call_predictor, predictor, args[i]): i for i in pending}
+                for future in tqdm(as_completed(futures), total=len(futures), desc=self.name):
+                    i = futures[future]
+                    results[i] = future.result()
+                    if self.cache is not None:
+                        self.cache.put(keys[i], results[i])
+        return results
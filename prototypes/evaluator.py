@@ -5,8 +5,7 @@ import plotly.express as px
 import plotly.graph_objects as go
 from itertools import accumulate
 import math
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
+from prototypes.eval_runner import EvaluationRunner, item_key, predictor_version, MISSING
 
 GREEN = "\033[92m"
 YELLOW = "\033[93m"
@@ -19,7 +18,13 @@ DEFAULT_SIZE = 200
 
 
 class Tester:
-    def __init__(self, predictor, data, title=None, size=DEFAULT_SIZE, workers=WORKERS):
+    def __init__(self, predictor, data, title=None, size=DEFAULT_SIZE, workers=WORKERS, executor="thread", cache_dir=None, version=None):
+        """
+        :param executor: "thread" for I/O-bound predictors, "process" for CPU-bound (picklable) ones
+        :param cache_dir: (Optional) where each prediction is persisted as it arrives, so a re-run resumes,
+            e.g. eval_runner.RESULTS_DIR; no caching by default
+        :param version: (Optional) identifies the predictor in the cache, e.g. a model revision; a hash of its code by default
+        """
         self.predictor = predictor
         self.data = data
         self.title = title or self.make_title(predictor)
@@ -30,6 +35,9 @@ class Tester:
         self.errors = []
         self.colors = []
         self.workers = workers
+        self.executor = executor
+        self.cache_dir = cache_dir
+        self.version = version
 
     @staticmethod
     def make_title(predictor) -> str:
@@ -37,6 +45,9 @@ class Tester:
 
     @staticmethod
     def post_process(value):
+        ### No answer scores like an answer without a price
+        if value is None:
+            return 0
         if isinstance(value, str):
             value = value.replace("$", "").replace(",", "")
             match = re.search(r"[-+]?\d*\.\d+|\d+", value)
@@ -52,9 +63,10 @@ class Tester:
         else:
             return "red"
 
-    def run_datapoint(self, i):
+    def run_datapoint(self, i, value=MISSING):
         datapoint = self.data[i]
-        value = self.predictor(datapoint)
+        if value is MISSING:
+            value = self.predictor(datapoint)
         guess = self.post_process(value)
         truth = datapoint.price
         error = abs(guess - truth)
@@ -201,18 +213,21 @@ class Tester:
         self.chart(title)
 
     def run(self):
-        with ThreadPoolExecutor(max_workers=self.workers) as ex:
-            for title, guess, truth, error, color in tqdm(
-                ex.map(self.run_datapoint, range(self.size)), total=self.size
-            ):
-                self.titles.append(title)
-                self.guesses.append(guess)
-                self.truths.append(truth)
-                self.errors.append(error)
-                self.colors.append(color)
-                print(f"{COLOR_MAP[color]}${error:.0f} ", end="")
+        datapoints = [self.data[i] for i in range(self.size)]
+        version = predictor_version(self.predictor, self.version) if self.cache_dir else None
+        runner = EvaluationRunner(re.sub(r"\W+", "_", self.title).lower(), self.workers, self.executor, self.cache_dir, version)
+        values = runner.run(self.predictor, [(datapoint,) for datapoint in datapoints], [item_key(d) for d in datapoints])
+
+        for i, value in enumerate(values):
+            title, guess, truth, error, color = self.run_datapoint(i, value)
+            self.titles.append(title)
+            self.guesses.append(guess)
+            self.truths.append(truth)
+            self.errors.append(error)
+            self.colors.append(color)
+            print(f"{COLOR_MAP[color]}${error:.0f} ", end="")
         self.report()
 
 
-def evaluate(function, data, size=DEFAULT_SIZE, workers=WORKERS):
-    Tester(function, data, size=size, workers=workers).run()
+def evaluate(function, data, size=DEFAULT_SIZE, workers=WORKERS, executor="thread", cache_dir=None, version=None):
+    Tester(function, data, size=size, workers=workers, executor=executor, cache_dir=cache_dir, version=version).run()
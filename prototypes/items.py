@@ -1,5 +1,9 @@
-from typing import Optional
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from transformers import AutoTokenizer
+import os
 import re
 
 BASE_MODEL = "meta-llama/Meta-Llama-3.1-8B"
@@ -8,13 +12,17 @@ MAX_TOKENS = 160
 MIN_CHARS = 300
 CEILING_CHARS = MAX_TOKENS * 7
 
+### Compiled once, rather than on every call to scrub
+SCRUB_PATTERN = re.compile(r'[:\[\]"{}【】\s]+')
+
 
 class Item:
     """
     An Item is a cleaned, curated datapoint of a Product with a Price
     """
 
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, trust_remote_code=True)
+    ### Loaded on first use, once per process
+    tokenizer = None
     PREFIX = "Price is $"
     QUESTION = "How much does this cost to the nearest dollar?"
     REMOVALS = ['"Batteries Included?": "No"', '"Batteries Included?": "Yes"', '"Batteries Required?": "No"',
@@ -29,10 +37,22 @@ class Item:
     prompt: Optional[str] = None
     include = False
 
-    def __init__(self, data, price):
+    def __init__(self, data, price, parse=True):
+        """
+        :param data: the product datapoint
+        :param price: the product's price
+        :param parse: parse the datapoint right away; curate() turns this off to tokenize a whole batch at once
+        """
         self.title = data['title']
         self.price = price
-        self.parse(data)
+        if parse:
+            self.parse(data)
+
+    @classmethod
+    def get_tokenizer(cls):
+        if cls.tokenizer is None:
+            cls.tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL, trust_remote_code=True, use_fast=True)
+        return cls.tokenizer
 
     def scrub_details(self):
         """
@@ -48,16 +68,15 @@ class Item:
         Clean up the provided text by removing unnecessary characters and whitespace
         Also remove words that are 7+ chars and contain numbers, as these are likely irrelevant product numbers
         """
-        stuff = re.sub(r'[:\[\]"{}【】\s]+', ' ', stuff).strip()
+        stuff = SCRUB_PATTERN.sub(' ', stuff).strip()
         stuff = stuff.replace(" ,", ",").replace(",,,", ",").replace(",,", ",")
         words = stuff.split(' ')
         select = [word for word in words if len(word) < 7 or not any(char.isdigit() for char in word)]
         return " ".join(select)
 
-    def parse(self, data):
+    def prepare(self, data) -> Optional[str]:
         """
-        Parse this datapoint and if it fits within the allowed Token range,
-        then set include to True
+        Build the scrubbed text to be tokenized, or return None if the datapoint is too short to use
         """
         contents = '\n'.join(data['description'])
         if contents:
@@ -70,21 +89,58 @@ class Item:
             contents += self.scrub_details() + '\n'
         if len(contents) > MIN_CHARS:
             contents = contents[:CEILING_CHARS]
-            text = f"{self.scrub(self.title)}\n{self.scrub(contents)}"
-            tokens = self.tokenizer.encode(text, add_special_tokens=False)
-            if len(tokens) > MIN_TOKENS:
-                tokens = tokens[:MAX_TOKENS]
-                text = self.tokenizer.decode(tokens)
-                self.make_prompt(text)
-                self.include = True
+            return f"{self.scrub(self.title)}\n{self.scrub(contents)}"
+        return None
+
+    def accept(self, tokens: List[int], text: str = None) -> None:
+        """
+        Include this datapoint if its tokens fit within the allowed range, truncating them to MAX_TOKENS
+
+        :param tokens: the tokens of the prepared text
+        :param text: (Optional) the already decoded truncated tokens, when a batch was decoded at once
+        """
+        if len(tokens) > MIN_TOKENS:
+            tokens = tokens[:MAX_TOKENS]
+            if text is None:
+                text = self.get_tokenizer().decode(tokens)
+            self.make_prompt(text, len(tokens))
+            self.include = True
+
+    def parse(self, data):
+        """
+        Parse this datapoint and if it fits within the allowed Token range,
+        then set include to True
+        """
+        text = self.prepare(data)
+        if text:
+            self.accept(self.get_tokenizer().encode(text, add_special_tokens=False))
 
-    def make_prompt(self, text):
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def extra_tokens(price_text: str) -> int:
+        """
+        The number of tokens the question and the price add around the text of a prompt
+        """
+        tokenizer = Item.get_tokenizer()
+        question = tokenizer.encode(f"{Item.QUESTION}\n\n", add_special_tokens=False)
+        answer = tokenizer.encode(f"\n\n{Item.PREFIX}{price_text}.00", add_special_tokens=False)
+        return len(question) + len(answer)
+
+    def make_prompt(self, text, text_tokens: int = None):
         """
         Set the prompt instance variable to be a prompt appropriate for training
+
+        :param text: the truncated item text
+        :param text_tokens: (Optional) the number of tokens of the text, if already known.
+            The token count is then derived from it instead of encoding the whole prompt again
         """
+        price_text = str(round(self.price))
         self.prompt = f"{self.QUESTION}\n\n{text}\n\n"
-        self.prompt += f"{self.PREFIX}{str(round(self.price))}.00"
-        self.token_count = len(self.tokenizer.encode(self.prompt, add_special_tokens=False))
+        self.prompt += f"{self.PREFIX}{price_text}.00"
+        if text_tokens is None:
+            self.token_count = len(self.get_tokenizer().encode(self.prompt, add_special_tokens=False))
+        else:
+            self.token_count = text_tokens + self.extra_tokens(price_text)
 
     def test_prompt(self):
         """
@@ -96,4 +152,148 @@ class Item:
         """
         Return a String version of this Item
         """
-        return f"<{self.title} = ${self.price}>"
\ No newline at end of file
+        return f"<{self.title} = ${self.price}>"
+
+
+def curate_batch(datapoints: List[Tuple[dict, float]]) -> List[Item]:
+    """
+    Curate a batch of (datapoint, price) pairs, with one batched encode and one batched decode
+    through the fast tokenizer
+
+    :return: the Items that fit within the allowed token range, in order
+    """
+    tokenizer = Item.get_tokenizer()
+    items = [Item(data, price, parse=False) for data, price in datapoints]
+    texts = [item.prepare(data) for item, (data, _) in zip(items, datapoints)]
+
+    prepared = [(item, text) for item, text in zip(items, texts) if text]
+    if not prepared:
+        return []
+    encodings = tokenizer([text for _, text in prepared], add_special_tokens=False)["input_ids"]
+
+    long_enough = [(item, tokens[:MAX_TOKENS]) for (item, _), tokens in zip(prepared, encodings) if len(tokens) > MIN_TOKENS]
+    decoded = tokenizer.batch_decode([tokens for _, tokens in long_enough])
+    for (item, tokens), text in zip(long_enough, decoded):
+        item.accept(tokens, text)
+
+    return [item for item in items if item.include]
+
+
+def curate(datapoints: Iterable[Tuple[dict, float]], workers: int = None, chunk_size: int = 1000) -> List[Item]:
+    """
+    Curate a whole dataset, sharding it into chunks across a pool of processes
+
+    :param datapoints: (datapoint, price) pairs
+    :param workers: the number of processes; all CPUs by default, 1 to curate in this process
+    :param chunk_size: the number of datapoints per batch
+    :return: the curated Items, in the order of the datapoints
+    """
+    workers = workers or os.cpu_count() or 1
+    iterator = iter(datapoints)
+    chunks = iter(lambda: list(islice(iterator, chunk_size)), [])
+
+    if workers == 1:
+        return [item for chunk in chunks for item in curate_batch(chunk)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch in executor.map(curate_batch, chunks):
+            results.extend(batch)
+    return results
+
+
+### Columnar storage for curated Items
+
+ITEM_COLUMNS = ["title", "price", "category", "token_count", "details", "prompt"]
+
+
+def save_items(items: Iterable[Item], path: str) -> None:
+    """
+    Write curated Items to a columnar file: .arrow (uncompressed Arrow IPC, memory-mappable) or .parquet (compressed)
+    """
+    import pyarrow as pa
+
+    items = list(items)
+    table = pa.table({
+        "title": pa.array([item.title for item in items], pa.string()),
+        "price": pa.array([item.price for item in items], pa.float64()),
+        "category": pa.array([getattr(item, "category", None) for item in items], pa.string()).dictionary_encode(),
+        "token_count": pa.array([item.token_count for item in items], pa.int32()),
+        "details": pa.array([item.details for item in items], pa.string()),
+        "prompt": pa.array([item.prompt for item in items], pa.string()),
+    })
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    else:
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+class ItemView:
+    """
+    A lightweight, read-only Item backed by one row of an ItemTable.
+    Fields are read from the columns on access, so millions of views cost almost nothing
+    """
+
+    __slots__ = ("table", "row")
+
+    PREFIX = Item.PREFIX
+
+    def __init__(self, table: "ItemTable", row: int):
+        self.table = table
+        self.row = row
+
+    def __getattr__(self, name):
+        if name in ITEM_COLUMNS:
+            return self.table.value(name, self.row)
+        raise AttributeError(name)
+
+    @property
+    def include(self) -> bool:
+        return True
+
+    test_prompt = Item.test_prompt
+    __repr__ = Item.__repr__
+
+
+class ItemTable:
+    """
+    A sequence of curated Items stored column by column in an Arrow table.
+    Loading an .arrow file memory-maps it, so it takes milliseconds and the strings stay out of the Python heap
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.columns = {name: table.column(name).combine_chunks() for name in table.column_names}
+
+    @classmethod
+    def load(cls, path: str) -> "ItemTable":
+        import pyarrow as pa
+
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            return cls(pq.read_table(path, memory_map=True))
+        return cls(pa.ipc.open_file(pa.memory_map(path, "r")).read_all())
+
+    def value(self, name: str, row: int):
+        return self.columns[name][row].as_py()
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[ItemView, "ItemTable"]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            ### Zero-copy
+            return ItemTable(self.table.slice(start, stop - start))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return ItemView(self, index)
+
+    def __iter__(self) -> Iterator[ItemView]:
+        return (ItemView(self, row) for row in range(len(self)))
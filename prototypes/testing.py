@@ -1,5 +1,7 @@
+import re
 import math
 import matplotlib.pyplot as plt
+from prototypes.eval_runner import EvaluationRunner, item_key, predictor_version, MISSING
 
 GREEN = "\033[92m"
 YELLOW = "\033[93m"
@@ -10,7 +12,14 @@ COLOR_MAP = {"red": RED, "orange": YELLOW, "green": GREEN}
 
 class Tester:
 
-    def __init__(self, predictor, data, title=None, size=250):
+    def __init__(self, predictor, data, title=None, size=250, workers=1, executor="thread", cache_dir=None, version=None):
+        """
+        :param workers: the number of concurrent predictor calls
+        :param executor: "thread" for I/O-bound predictors, "process" for CPU-bound (picklable) ones
+        :param cache_dir: (Optional) where each prediction is persisted as it arrives, so a re-run resumes,
+            e.g. eval_runner.RESULTS_DIR; no caching by default
+        :param version: (Optional) identifies the predictor in the cache, e.g. a model revision; a hash of its code by default
+        """
         self.predictor = predictor
         self.data = data
         self.title = title or predictor.__name__.replace("_", " ").title()
@@ -20,6 +29,10 @@ class Tester:
         self.errors = []
         self.sles = []
         self.colors = []
+        self.workers = workers
+        self.executor = executor
+        self.cache_dir = cache_dir
+        self.version = version
 
     def color_for(self, error, truth):
         if error < 40 or error / truth < 0.2:
@@ -29,9 +42,16 @@ class Tester:
         else:
             return "red"
 
-    def run_datapoint(self, i):
+    def predictor_args(self, datapoint) -> tuple:
+        return datapoint.prompt, datapoint.price
+
+    def run_datapoint(self, i, guess=MISSING):
         datapoint = self.data[i]
-        guess = self.predictor(datapoint.prompt, datapoint.price)
+        if guess is MISSING:
+            guess = self.predictor(*self.predictor_args(datapoint))
+        ### No answer scores as a guess of 0
+        if guess is None:
+            guess = 0
         truth = datapoint.price
         error = abs(guess - truth)
         log_error = math.log(truth + 1) - math.log(guess + 1)
@@ -68,10 +88,14 @@ class Tester:
 
     def run(self):
         self.error = 0
-        for i in range(self.size):
-            self.run_datapoint(i)
+        datapoints = [self.data[i] for i in range(self.size)]
+        version = predictor_version(self.predictor, self.version) if self.cache_dir else None
+        runner = EvaluationRunner(re.sub(r"\W+", "_", self.title).lower(), self.workers, self.executor, self.cache_dir, version)
+        guesses = runner.run(self.predictor, [self.predictor_args(d) for d in datapoints], [item_key(d) for d in datapoints])
+        for i, guess in enumerate(guesses):
+            self.run_datapoint(i, guess)
         self.report()
 
     @classmethod
-    def test(cls, function, data):
-        cls(function, data).run()
\ No newline at end of file
+    def test(cls, function, data, workers=1, executor="thread", cache_dir=None, version=None):
+        cls(function, data, workers=workers, executor=executor, cache_dir=cache_dir, version=version).run()
\ No newline at end of file
@@ -2,7 +2,7 @@ import math
 import matplotlib.pyplot as plt
 from typing import Dict
 
-from testing import Tester
+from prototypes.testing import Tester
 
 GREEN = "\033[92m"
 YELLOW = "\033[93m"
@@ -13,13 +13,17 @@ COLOR_MAP = {"red": RED, "orange": YELLOW, "green": GREEN}
 
 class TesterForNeuralNetwork(Tester):
 
-    def __init__(self, predictor, data, title=None, size=250):
-        super().__init__(predictor, data, title=None, size=size)
+    def __init__(self, predictor, data, title=None, size=250, **kwargs):
+        super().__init__(predictor, data, title=None, size=size, **kwargs)
         self.data = data
 
-    def run_datapoint(self, i):
+    def predictor_args(self, datapoint) -> tuple:
+        return (datapoint["item"],)
+
+    def run_datapoint(self, i, guess=None):
         datapoint = self.data[i]
-        guess = self.predictor(datapoint["item"])
+        if guess is None:
+            guess = self.predictor(*self.predictor_args(datapoint))
         truth = datapoint["price"]
         title = datapoint["title"]
         
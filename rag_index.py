@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+from typing import List, Tuple
+import numpy as np
+### Internal classes
+import vectorstore
+
+INDEX_DIR = os.getenv("RAG_INDEX_DIR", os.path.join(vectorstore.DB, "numpy_index"))
+
+### Number of IVF lists searched per query; more is slower and closer to an exact search
+NPROBE = int(os.getenv("RAG_NPROBE", "8"))
+
+PAGE_SIZE = 5000
+
+
+class NumpyRagIndex:
+    """
+    A read-only, in-memory alternative to querying Chroma for the Frontier Agent's RAG search.
+    Embeddings and prices are exported from the products collection into compact float16 or int8 arrays,
+    grouped into IVF lists by k-means, and memory-mapped on load so several processes share the same pages.
+    Distances are squared L2, the same metric as the Chroma collection.
+    """
+
+    def __init__(self, directory: str = INDEX_DIR, nprobe: int = NPROBE):
+        """
+        Load an exported index, memory-mapping its arrays
+
+        :param directory: where the index was exported to
+        :param nprobe: the number of IVF lists searched per query
+        """
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.nprobe = nprobe
+
+        def load(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        self.embeddings = load("embeddings")
+        self.scales = load("scales") if self.meta["dtype"] == "int8" else None
+        self.norms = load("norms")
+        self.prices = load("prices")
+        self.centroids = np.asarray(load("centroids"), dtype=np.float32)
+        self.list_offsets = np.asarray(load("list_offsets"))
+        self.doc_offsets = load("doc_offsets")
+        self.doc_bytes = np.memmap(os.path.join(directory, "documents.bin"), dtype=np.uint8, mode="r")
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    @classmethod
+    def export(cls, collection, directory: str = INDEX_DIR, dtype: str = "float16", nlist: int = None) -> None:
+        """
+        Export the collection into an index on disk
+
+        :param collection: the Chroma collection to export
+        :param directory: where to write the index
+        :param dtype: "float16", or "int8" with one scale per row for a quarter of the float32 size
+        :param nlist: (Optional) the number of IVF lists - about sqrt(count) by default, 0 for an exact search
+        """
+        from sklearn.cluster import MiniBatchKMeans
+
+        vectors, prices, documents = [], [], []
+        offset = 0
+        while True:
+            page = collection.get(include=["embeddings", "documents", "metadatas"], limit=PAGE_SIZE, offset=offset)
+            if not page["ids"]:
+                break
+            vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+            prices.extend(metadata["price"] for metadata in page["metadatas"])
+            documents.extend(page["documents"])
+            offset += len(page["ids"])
+        vectors = np.concatenate(vectors)
+        prices = np.asarray(prices, dtype=np.float32)
+        count, dim = vectors.shape
+
+        if nlist is None:
+            nlist = int(np.sqrt(count))
+        if nlist > 1:
+            kmeans = MiniBatchKMeans(n_clusters=nlist, random_state=42, batch_size=4096, n_init=1).fit(vectors)
+            labels = kmeans.labels_
+            centroids = kmeans.cluster_centers_.astype(np.float32)
+        else:
+            nlist = 1
+            labels = np.zeros(count, dtype=np.int64)
+            centroids = vectors.mean(axis=0, keepdims=True)
+
+        ### Rows of the same IVF list are stored contiguously, so a list is a slice
+        order = np.argsort(labels, kind="stable")
+        vectors, prices = vectors[order], prices[order]
+        documents = [documents[i] for i in order]
+        list_offsets = np.searchsorted(labels[order], np.arange(nlist + 1)).astype(np.int64)
+
+        if dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+            stored = np.round(vectors / scales[:, None]).astype(np.int8)
+            restored = stored.astype(np.float32) * scales[:, None]
+        elif dtype == "float16":
+            scales = None
+            stored = vectors.astype(np.float16)
+            restored = stored.astype(np.float32)
+        else:
+            raise ValueError(f"Unknown dtype: {dtype}")
+
+        encoded = [document.encode() for document in documents]
+        doc_offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=doc_offsets[1:])
+
+        os.makedirs(directory, exist_ok=True)
+        arrays = {
+            "embeddings": stored,
+            "norms": (restored ** 2).sum(axis=1).astype(np.float32),
+            "prices": prices,
+            "centroids": centroids,
+            "list_offsets": list_offsets,
+            "doc_offsets": doc_offsets,
+        }
+        if scales is not None:
+            arrays["scales"] = scales.astype(np.float32)
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        with open(os.path.join(directory, "documents.bin"), "wb") as f:
+            f.write(b"".join(encoded))
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"count": count, "dim": dim, "dtype": dtype, "nlist": nlist}, f)
+
+    def document(self, row: int) -> str:
+        start, end = self.doc_offsets[row], self.doc_offsets[row + 1]
+        return self.doc_bytes[start:end].tobytes().decode()
+
+    def distances(self, vectors: np.ndarray, start: int, end: int) -> np.ndarray:
+        """
+        Squared L2 distances between the queries and the rows in [start, end), shape (queries, rows)
+        """
+        rows = np.asarray(self.embeddings[start:end], dtype=np.float32)
+        if self.scales is not None:
+            rows *= self.scales[start:end, None]
+        return self.norms[start:end][None, :] - 2 * vectors @ rows.T + (vectors ** 2).sum(axis=1)[:, None]
+
+    def search(self, vectors, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batched top-k search. Each probed IVF list is decoded once per batch and scored against
+        every query that probes it in a single matrix product
+
+        :param vectors: one query embedding, or a 2D array of them
+        :param k: the number of neighbors per query
+        :return: (rows, distances), each of shape (queries, k), nearest first; -1 pads missing neighbors
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroid_distances = (self.centroids ** 2).sum(axis=1)[None, :] - 2 * vectors @ self.centroids.T
+        probes = np.argpartition(centroid_distances, nprobe - 1, axis=1)[:, :nprobe]
+
+        candidate_rows = [[] for _ in vectors]
+        candidate_distances = [[] for _ in vectors]
+        for l in np.unique(probes):
+            queries = np.nonzero((probes == l).any(axis=1))[0]
+            start, end = self.list_offsets[l], self.list_offsets[l + 1]
+            distances = self.distances(vectors[queries], start, end)
+            for q, row_distances in zip(queries, distances):
+                candidate_rows[q].append(np.arange(start, end))
+                candidate_distances[q].append(row_distances)
+
+        all_rows = np.full((len(vectors), k), -1, dtype=np.int64)
+        all_distances = np.full((len(vectors), k), np.inf, dtype=np.float32)
+        for q in range(len(vectors)):
+            rows = np.concatenate(candidate_rows[q])
+            distances = np.concatenate(candidate_distances[q])
+            top = min(k, len(rows))
+            nearest = np.argpartition(distances, top - 1)[:top] if top < len(rows) else np.arange(len(rows))
+            nearest = nearest[np.argsort(distances[nearest])]
+            all_rows[q, :top] = rows[nearest]
+            all_distances[q, :top] = distances[nearest]
+        return all_rows, all_distances
+
+    def query(self, vectors, k: int = 5) -> List[Tuple[List[str], List[float]]]:
+        """
+        Return the documents and prices of the k nearest products, for each query
+        """
+        rows, _ = self.search(vectors, k)
+        return [
+            ([self.document(r) for r in row if r >= 0], [float(self.prices[r]) for r in row if r >= 0])
+            for row in rows
+        ]
+
+
+def perturbed(vectors: np.ndarray, noise: float = 0.3, seed: int = 0) -> np.ndarray:
+    """
+    Benchmark queries near, but not at, stored embeddings: each vector plus a random offset of noise times its length.
+    A stored embedding queried as is would find itself first and inflate recall
+
+    :param vectors: embeddings sampled from the collection
+    :param noise: the length of the offset, relative to the vector's
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    offsets = rng.standard_normal(vectors.shape).astype(np.float32)
+    offsets *= noise * np.linalg.norm(vectors, axis=1, keepdims=True) / np.linalg.norm(offsets, axis=1, keepdims=True)
+    return vectors + offsets
+
+
+def benchmark(index: NumpyRagIndex, collection, queries: np.ndarray, k: int = 5, sources: List[str] = None) -> dict:
+    """
+    Compare the index against Chroma on the same queries
+
+    :param sources: (Optional) the document each query was derived from, left out of both results
+    :return: recall@k of the index against Chroma's results, and queries per second for both
+    """
+    n = k + 1 if sources else k
+
+    def top(documents, source):
+        return [d for d in documents if d != source][:k]
+
+    start = time.perf_counter()
+    chroma_documents = [
+        collection.query(query_embeddings=[q.tolist()], n_results=n, include=["documents"])["documents"][0]
+        for q in queries
+    ]
+    chroma_qps = len(queries) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    results = index.query(queries, n)
+    index_qps = len(queries) / (time.perf_counter() - start)
+
+    sources = sources or [None] * len(queries)
+    hits = sum(
+        len(set(top(expected, source)) & set(top(documents, source)))
+        for expected, (documents, _), source in zip(chroma_documents, results, sources)
+    )
+    return {
+        f"recall@{k}": hits / (k * len(queries)),
+        "chroma_qps": chroma_qps,
+        "index_qps": index_qps,
+    }
+
+
+if __name__ == "__main__":
+    ### python rag_index.py export [float16|int8]
+    ### python rag_index.py benchmark [number of queries] [noise]
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    collection = vectorstore.get_collection()
+    if command == "export":
+        NumpyRagIndex.export(collection, dtype=sys.argv[2] if len(sys.argv) > 2 else "float16")
+    elif command == "benchmark":
+        size = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        noise = float(sys.argv[3]) if len(sys.argv) > 3 else 0.3
+        sample = collection.get(include=["embeddings", "documents"], limit=size)
+        queries = perturbed(sample["embeddings"], noise)
+        print(json.dumps(benchmark(NumpyRagIndex(), collection, queries, sources=sample["documents"]), indent=2))
+    else:
+        raise ValueError(f"Unknown command: {command}")
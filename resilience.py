@@ -0,0 +1,190 @@
+"""
+Guards for the calls the Ensemble Agent makes to its models, so a slow or failing model can't stall a run:
+- a deadline per model
+- a hedged duplicate request once a call has taken longer than the model's recent p95 latency
+- a circuit breaker per model, which stops calling a model that keeps failing for a cool-down period
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict
+import numpy as np
+
+### Seconds each model has to answer, hedges included
+DEADLINES = {
+    "neural_network": float(os.getenv("NEURAL_NETWORK_DEADLINE", "10")),
+    "frontier": float(os.getenv("FRONTIER_DEADLINE", "30")),
+    "specialist": float(os.getenv("SPECIALIST_DEADLINE", "60")),
+}
+
+### Only the remote models are worth hedging
+HEDGED = {"frontier", "specialist"}
+
+### Latencies remembered per model, and how many are needed before hedging starts
+LATENCY_WINDOW = 100
+MIN_SAMPLES = 20
+
+### A breaker opens after this many failed or slow calls in a row, and stays open for the cool-down
+FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURES", "3"))
+COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "120"))
+### A call counts as slow when it takes more than this fraction of the model's deadline
+SLOW_FRACTION = 0.5
+
+### Calls still running after their deadline keep a thread until they finish, so the pool is roomy
+executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="model-call")
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class GuardedCall:
+    """
+    Calls a model's function with a deadline, hedging slow calls with a second identical request
+    """
+
+    def __init__(self, name: str, function: Callable, deadline: float = None, hedge: bool = None):
+        """
+        :param name: the model's name, e.g. "frontier"
+        :param function: the call to guard, e.g. the model's price method
+        :param deadline: (Optional) seconds to answer; DEADLINES[name] by default
+        :param hedge: (Optional) whether to send hedged requests; True for the models in HEDGED by default
+        """
+        self.name = name
+        self.function = function
+        self.deadline = deadline if deadline is not None else DEADLINES.get(name, 60.0)
+        self.hedge = hedge if hedge is not None else name in HEDGED
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+        self.hedges = 0
+
+    def hedge_delay(self):
+        """
+        Seconds to wait before hedging: the p95 of recent latencies, or None when not hedging yet
+        """
+        with self.lock:
+            if not self.hedge or len(self.latencies) < MIN_SAMPLES:
+                return None
+            return float(np.percentile(self.latencies, 95))
+
+    def submit(self, *args):
+        """
+        Start a call on the pool, in a copy of the caller's context so that its trace spans nest under the caller's
+        """
+        return executor.submit(contextvars.copy_context().run, self.function, *args)
+
+    def __call__(self, *args):
+        start = time.monotonic()
+        deadline_at = start + self.deadline
+        delay = self.hedge_delay()
+        hedge_at = start + delay if delay is not None else None
+        pending = {self.submit(*args)}
+        error = None
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline_at:
+                raise DeadlineExceeded(f"{self.name} did not answer within {self.deadline:g}s")
+            timeout = deadline_at - now
+            if hedge_at is not None:
+                timeout = min(timeout, max(hedge_at - now, 0))
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    with self.lock:
+                        self.latencies.append(time.monotonic() - start)
+                    return future.result()
+                error = future.exception()
+
+            if hedge_at is not None and time.monotonic() >= hedge_at and pending:
+                pending.add(self.submit(*args))
+                hedge_at = None
+                with self.lock:
+                    self.hedges += 1
+            elif not pending:
+                raise error
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of one model. Closed: calls go through. Open: calls are skipped until the cool-down ends.
+    Half-open: a single trial call decides whether to close again or reopen
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int = FAILURE_THRESHOLD,
+            cooldown: float = COOLDOWN_SECONDS,
+            slow_call: float = None,
+    ):
+        """
+        :param name: the model's name
+        :param failure_threshold: the number of failed or slow calls in a row that opens the breaker
+        :param cooldown: seconds the breaker stays open
+        :param slow_call: (Optional) seconds above which a call counts as failed; half the model's deadline by default
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.slow_call = slow_call if slow_call is not None else DEADLINES.get(name, 60.0) * SLOW_FRACTION
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Whether the model should be called now
+        """
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self.trial = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record(self, seconds: float = None, error: bool = False) -> None:
+        """
+        Record the outcome of a call: how long it took, or that it failed
+        """
+        failed = error or (seconds is not None and seconds > self.slow_call)
+        with self.lock:
+            self.trial = False
+            if not failed:
+                self.failures = 0
+                self.state = self.CLOSED
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"[Circuit Breaker] {self.name} is unavailable, skipping it for {self.cooldown:g}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+breakers_lock = threading.Lock()
+breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(name: str) -> CircuitBreaker:
+    """
+    Return the process-wide breaker of a model, shared by every agent that calls it
+    """
+    with breakers_lock:
+        if name not in breakers:
+            breakers[name] = CircuitBreaker(name)
+        return breakers[name]
@@ -0,0 +1,117 @@
+import os
+import random
+import logging
+import threading
+from typing import Callable, List, Optional
+
+### Seconds between runs, varied by up to RUN_JITTER of it either way so runs don't fall into lockstep
+RUN_INTERVAL = float(os.getenv("RUN_INTERVAL_SECONDS", "600"))
+RUN_JITTER = float(os.getenv("RUN_JITTER", "0.1"))
+
+
+class RunScheduler:
+    """
+    The one owner of the agent framework's runs in this process.
+    Runs on its own thread at jittered intervals, never more than one at a time, and hands each result
+    to every subscriber - so any number of UI sessions share the same runs instead of starting their own
+    """
+
+    def __init__(self, run: Callable[[], List], interval: float = RUN_INTERVAL, jitter: float = RUN_JITTER):
+        """
+        :param run: the work of one run, e.g. DealAgentFramework.run; its result is published to subscribers
+        :param interval: seconds between the start of one run and the next
+        :param jitter: the fraction by which each interval is randomly varied
+        """
+        self.run = run
+        self.interval = interval
+        self.jitter = jitter
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.running = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.subscribers: List[Callable] = []
+        self.latest = None
+
+    def start(self) -> None:
+        """
+        Start the scheduler thread, which runs straight away and then every interval; calling it again does nothing
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, name="run-scheduler", daemon=True)
+                self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.wake.set()
+
+    def trigger(self) -> None:
+        """
+        Ask for a run now; requests made during a run are coalesced into a single run after it
+        """
+        self.wake.set()
+
+    def subscribe(self, callback: Callable) -> Callable[[], None]:
+        """
+        Call back with the result of every run from now on
+        :return: a function that unsubscribes
+        """
+        with self.lock:
+            self.subscribers.append(callback)
+
+        def unsubscribe():
+            with self.lock:
+                if callback in self.subscribers:
+                    self.subscribers.remove(callback)
+
+        return unsubscribe
+
+    def next_delay(self) -> float:
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run_once(self) -> bool:
+        """
+        Run now, unless a run is already in flight
+        :return: whether a run took place
+        """
+        if not self.running.acquire(blocking=False):
+            return False
+        try:
+            result = self.run()
+        except Exception:
+            logging.exception("[Run Scheduler] The run failed")
+            return True
+        finally:
+            self.running.release()
+
+        self.latest = result
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(result)
+            except Exception:
+                logging.exception("[Run Scheduler] A subscriber failed")
+        return True
+
+    def loop(self) -> None:
+        while not self.stopped.is_set():
+            self.run_once()
+            self.wake.wait(self.next_delay())
+            self.wake.clear()
+
+
+if __name__ == "__main__":
+    ### Headless: run on schedule without the UI, tailing each run's result to the console
+    from deal_agent_framework import DealAgentFramework
+    from event_bus import bus, tail, RESULT
+
+    framework = DealAgentFramework()
+    scheduler = RunScheduler(framework.run)
+    scheduler.subscribe(lambda opportunities: bus.publish(
+        RESULT, f"{len(opportunities)} opportunities, latest: {opportunities[-1].deal.url if opportunities else None}"
+    ))
+    subscription = bus.subscribe([RESULT])
+    scheduler.start()
+    tail(subscription)
@@ -0,0 +1,108 @@
+"""
+OpenTelemetry tracing of the agent pipeline.
+
+Spans are exported, by default, one JSON line each to traces.jsonl (TRACE_EXPORTER=file),
+or printed (console), sent to an OTLP collector (otlp), or turned off (none).
+To see where the last run spent its time:
+    python tracing.py [traces.jsonl]
+"""
+
+import os
+import sys
+import json
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Sequence
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider, ReadableSpan
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter, SpanExportResult
+
+EXPORTER = os.getenv("TRACE_EXPORTER", "file")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+SERVICE_NAME = "worthbrain"
+
+lock = threading.Lock()
+configured = False
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Appends each finished span to a file as one line of JSON
+    """
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        with self.lock, open(self.path, "a") as f:
+            for span in spans:
+                f.write(span.to_json(indent=None) + "\n")
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+
+def setup_tracing(exporter: str = EXPORTER) -> None:
+    """
+    Install the process-wide tracer provider; calling it again does nothing.
+    Until then, spans are no-ops, so tracing costs nothing when it's not set up
+
+    :param exporter: "file", "console", "otlp" or "none"
+    """
+    global configured
+    with lock:
+        if configured or exporter == "none":
+            return
+        if exporter == "file":
+            span_exporter = FileSpanExporter()
+        elif exporter == "console":
+            span_exporter = ConsoleSpanExporter()
+        elif exporter == "otlp":
+            from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+            span_exporter = OTLPSpanExporter()
+        else:
+            raise ValueError(f"Unknown trace exporter: {exporter}")
+        provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(span_exporter))
+        trace.set_tracer_provider(provider)
+        configured = True
+
+
+def summarize(path: str = TRACE_FILE) -> dict:
+    """
+    Time spent per span name in the most recent trace of a trace file
+
+    :return: {span name: {"count", "total_seconds", "max_seconds"}}, largest total first
+    """
+    spans = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue
+    if not spans:
+        return {}
+    last = max(spans, key=lambda span: span["end_time"])["context"]["trace_id"]
+
+    def seconds(span):
+        start, end = (datetime.fromisoformat(span[key].replace("Z", "+00:00")) for key in ("start_time", "end_time"))
+        return (end - start).total_seconds()
+
+    totals = defaultdict(lambda: {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+    for span in spans:
+        if span["context"]["trace_id"] == last:
+            entry = totals[span["name"]]
+            duration = seconds(span)
+            entry["count"] += 1
+            entry["total_seconds"] += duration
+            entry["max_seconds"] = max(entry["max_seconds"], duration)
+    return dict(sorted(totals.items(), key=lambda item: item[1]["total_seconds"], reverse=True))
+
+
+if __name__ == "__main__":
+    print(json.dumps(summarize(sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE), indent=2))
@@ -0,0 +1,67 @@
+import os
+import threading
+from typing import Dict, Tuple
+import chromadb
+
+DB = os.getenv("PRODUCTION_DB", "products_vectorstore")
+COLLECTION = "products"
+
+### HNSW search breadth for queries; higher is more accurate and slower. Unset keeps the collection's own setting
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "0")) or None
+
+### Open the store for reading only, e.g. in the UI process, which never writes to it
+READ_ONLY = os.getenv("VECTORSTORE_READ_ONLY", "false").lower() == "true"
+
+lock = threading.Lock()
+clients: Dict[str, chromadb.ClientAPI] = {}
+collections: Dict[Tuple[str, str, bool], chromadb.Collection] = {}
+
+
+class ReadOnlyCollection:
+    """
+    A Chroma collection that can be queried and read, but refuses any write
+    """
+
+    WRITES = {"add", "upsert", "update", "delete", "modify"}
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        if name in self.WRITES:
+            raise PermissionError(f"The vectorstore collection is open read-only; {name} is not allowed")
+        return getattr(self.collection, name)
+
+
+def get_client(path: str = DB) -> chromadb.ClientAPI:
+    """
+    Return the process-wide Chroma client for this path, so its SQLite and HNSW handles are only opened once
+    """
+    with lock:
+        if path not in clients:
+            clients[path] = chromadb.PersistentClient(path=path)
+        return clients[path]
+
+
+def get_collection(name: str = COLLECTION, path: str = DB, read_only: bool = READ_ONLY, search_ef: int = HNSW_SEARCH_EF):
+    """
+    Return the process-wide collection shared by the framework, the Frontier Agent and the plot
+
+    :param name: the collection name
+    :param path: the vectorstore directory
+    :param read_only: open an existing collection without creating it, and refuse writes
+    :param search_ef: (Optional) the HNSW ef used by queries; not applied to a read-only collection, since it's a write
+    """
+    client = get_client(path)
+    key = (path, name, read_only)
+    with lock:
+        if key not in collections:
+            if read_only:
+                collections[key] = ReadOnlyCollection(client.get_collection(name))
+            else:
+                collection = client.get_or_create_collection(name)
+                hnsw = (collection.configuration or {}).get("hnsw") or {}
+                if search_ef and hnsw.get("ef_search") != search_ef:
+                    collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+                collections[key] = collection
+        return collections[key]